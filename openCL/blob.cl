@@ -0,0 +1,183 @@
+/*
+ *   Project: Blob detection OpenCL kernels for PyFAI.
+ *            Pyramid of gaussians, difference of gaussians and local maxima
+ *
+ *
+ *   Copyright (C) 2014 European Synchrotron Radiation Facility
+ *                           Grenoble, France
+ *
+ *   Principal authors: J. Kieffer (kieffer@esrf.fr)
+ *   Last revision: 15/10/2026
+ *
+ *   This program is free software: you can redistribute it and/or modify
+ *   it under the terms of the GNU General Public License as published
+ *   by the Free Software Foundation, either version 3 of the License, or
+ *   (at your option) any later version.
+ *
+ *   This program is distributed in the hope that it will be useful,
+ *   but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *   GNU Lesser General Public License for more details.
+ *
+ *   You should have received a copy of the GNU General Public License
+ *   and the GNU Lesser General Public License  along with this program.
+ *   If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/**
+ * \file
+ * \brief OpenCL kernels for the blob detection (see blob_detection.py)
+ *
+ * All images are float32 of shape (height, width), stored contiguously.
+ * Border mode of the convolutions is "reflect", like _convolution.pyx
+ */
+
+/**
+ * \brief 1D horizontal convolution with a filter
+ *
+ * @param input       Float pointer to global memory storing the image
+ * @param output      Float pointer to global memory storing the result
+ * @param filter      Float pointer to global memory storing the coefficients
+ * @param FILTER_SIZE Integer: number of coefficients of the filter (odd)
+ * @param IMAGE_W     Integer: width of the image
+ * @param IMAGE_H     Integer: height of the image
+ */
+kernel void
+horizontal_convolution(    const global float *input,
+                                 global float *output,
+                           const global float *filter,
+                           const          int  FILTER_SIZE,
+                           const          int  IMAGE_W,
+                           const          int  IMAGE_H)
+{
+    int x = get_global_id(0);
+    int y = get_global_id(1);
+    if ((x < IMAGE_W) && (y < IMAGE_H))
+    {
+        int HALF_FILTER_SIZE = FILTER_SIZE / 2;
+        float sum = 0.0f;
+        for (int f = 0; f < FILTER_SIZE; f++)
+        {
+            int pos = x + f - HALF_FILTER_SIZE;
+            if (pos < 0)
+                pos = -pos - 1;
+            else if (pos >= IMAGE_W)
+                pos = 2 * IMAGE_W - pos - 1;
+            sum += input[y * IMAGE_W + pos] * filter[f];
+        }
+        output[y * IMAGE_W + x] = sum;
+    }
+}
+
+/**
+ * \brief 1D vertical convolution with a filter
+ *
+ * Same parameters as horizontal_convolution
+ */
+kernel void
+vertical_convolution(      const global float *input,
+                                 global float *output,
+                           const global float *filter,
+                           const          int  FILTER_SIZE,
+                           const          int  IMAGE_W,
+                           const          int  IMAGE_H)
+{
+    int x = get_global_id(0);
+    int y = get_global_id(1);
+    if ((x < IMAGE_W) && (y < IMAGE_H))
+    {
+        int HALF_FILTER_SIZE = FILTER_SIZE / 2;
+        float sum = 0.0f;
+        for (int f = 0; f < FILTER_SIZE; f++)
+        {
+            int pos = y + f - HALF_FILTER_SIZE;
+            if (pos < 0)
+                pos = -pos - 1;
+            else if (pos >= IMAGE_H)
+                pos = 2 * IMAGE_H - pos - 1;
+            sum += input[pos * IMAGE_W + x] * filter[f];
+        }
+        output[y * IMAGE_W + x] = sum;
+    }
+}
+
+/**
+ * \brief Difference of gaussians, stored in the slice "scale" of the stack
+ *
+ * @param previous  Float pointer to global memory: less blurred image
+ * @param blurred   Float pointer to global memory: more blurred image
+ * @param dogs      Float pointer to global memory: stack of DoG (scale, height, width)
+ * @param scale     Integer: index of the slice to write
+ * @param size      Integer: number of pixels of one image
+ */
+kernel void
+difference_of_gaussians(   const global float *previous,
+                           const global float *blurred,
+                                 global float *dogs,
+                           const          int  scale,
+                           const          int  size)
+{
+    int i = get_global_id(0);
+    if (i < size)
+        dogs[scale * size + i] = previous[i] - blurred[i];
+}
+
+/**
+ * \brief Flags the local maxima in the stack of DoG
+ *
+ * Same definition as _blob.local_max: a point is a maximum if it is strictly
+ * larger than all its neighbours in the 3x3x3 cube, the same pixel in the
+ * previous/next scale included. If n_5 is set, the outer ring of the 5x5
+ * plane is also considered in the 3 scales, its 4 corners excluded.
+ * One work-item per pixel (x, y, scale).
+ *
+ * @param dogs      Float pointer to global memory: stack of DoG (scale, height, width)
+ * @param mask      Char pointer to global memory: non zero for invalid pixels
+ * @param is_max    Char pointer to global memory: output, 1 for maxima, 0 elsewhere
+ * @param do_mask   Integer: 1 to take the mask into account
+ * @param n_5       Integer: 1 to look into a 5x5 neighbourhood
+ * @param IMAGE_W   Integer: width of the image
+ * @param IMAGE_H   Integer: height of the image
+ * @param NS        Integer: number of scales in the stack
+ */
+kernel void
+local_max(                 const global float *dogs,
+                           const global char  *mask,
+                                 global char  *is_max,
+                           const          int  do_mask,
+                           const          int  n_5,
+                           const          int  IMAGE_W,
+                           const          int  IMAGE_H,
+                           const          int  NS)
+{
+    int x = get_global_id(0);
+    int y = get_global_id(1);
+    int s = get_global_id(2);
+    if ((x >= IMAGE_W) || (y >= IMAGE_H) || (s >= NS))
+        return;
+    int size = IMAGE_W * IMAGE_H;
+    int border = n_5 ? 2 : 1;
+    char res = 0;
+    if ((s > 0) && (s < NS - 1) &&
+        (x >= border) && (x < IMAGE_W - border) &&
+        (y >= border) && (y < IMAGE_H - border) &&
+        !(do_mask && mask[y * IMAGE_W + x]))
+    {
+        float c = dogs[s * size + y * IMAGE_W + x];
+        res = 1;
+        for (int ds = -1; (ds <= 1) && res; ds++)
+        {
+            for (int dy = -border; (dy <= border) && res; dy++)
+            {
+                for (int dx = -border; (dx <= border) && res; dx++)
+                {
+                    // the point itself and the corners of the 5x5 block are not compared
+                    if (((ds == 0) && (dy == 0) && (dx == 0)) || ((abs(dx) == 2) && (abs(dy) == 2)))
+                        continue;
+                    res = (c > dogs[(s + ds) * size + (y + dy) * IMAGE_W + x + dx]);
+                }
+            }
+        }
+    }
+    is_max[s * size + y * IMAGE_W + x] = res;
+}
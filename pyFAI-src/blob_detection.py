@@ -1,4 +1,6 @@
-import numpy, itertools, scipy
+import logging
+import numpy, scipy
+logger = logging.getLogger("pyFAI.blob_detection")
 try:
     from _convolution import gaussian_filter
 except ImportError:
@@ -7,6 +9,10 @@ try:
     from . import _blob
 except ImportError:
     _blob = None
+try:
+    from .ocl_blob import OCLBlob
+except ImportError:
+    OCLBlob = None
 
 try:
     from . import morphology
@@ -16,9 +22,14 @@ except ImportError:
 else:
     pyFAI_morphology = True
 
+try:
+    from .fastcrc import crc32
+except ImportError:
+    from zlib import crc32
+
 from math import sqrt
 
-from .utils import binning, timeit
+from .utils import timeit
 
 def image_test():
     img = numpy.zeros((128 * 4, 128 * 4))
@@ -36,92 +47,180 @@ def make_gaussian(im, sigma, xc, yc):
     if size % 2 == 0 :
            size += 1
     x = numpy.arange(0, size, 1, float)
-    y = x[:, numpy.newaxis]
-    x0 = y0 = size // 2
-    gaus = numpy.exp(-4 * numpy.log(2) * ((x - x0) ** 2 + (y - y0) ** 2) / sigma ** 2)
+    x0 = size // 2
+    # the 2D gaussian is separable: outer product of two 1D gaussians
+    g1d = numpy.exp(-4 * numpy.log(2) * (x - x0) ** 2 / sigma ** 2)
+    gaus = numpy.outer(g1d, g1d)
     im[xc - size / 2:xc + size / 2 + 1, yc - size / 2:yc + size / 2 + 1] = gaus
     return im
 
+# Relative (scale, y, x) positions of the neighbours of a point in the 3x3x3 cube,
+# starting with the same pixel in the previous/next scale
+NEIGHBOURS_3 = [(-1, 0, 0), (1, 0, 0)] + [(ds, dy, dx) for ds in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                                          if (dy, dx) != (0, 0)]
+# Plus the outer ring of the 5x5 plane in the 3 scales, without its corners (as _blob)
+NEIGHBOURS_5 = NEIGHBOURS_3 + [(ds, dy, dx) for ds in (-1, 0, 1) for dy in range(-2, 3) for dx in range(-2, 3)
+                               if max(abs(dy), abs(dx)) == 2 and min(abs(dy), abs(dx)) < 2]
+
+
 @timeit
-def local_max(dogs, mask=None, n_5=True):
+def local_max(dogs, mask=None, n_5=True, tile=256):
     """
+    A point is a maximum if it is strictly greater than all its neighbours,
+    same definition as _blob.local_max
+
     @param dogs: 3d array with (sigma,y,x) containing difference of gaussians 
     @parm mask: mask out keypoint next to the mask (or inside the mask)
     @param n_5: look for a larger neighborhood
+    @param tile: size of the square blocks processed at once, chosen for
+                 the 3 scales of a block to fit in the cache
     """
-    ns = dogs.shape[0]
-    kpma = numpy.zeros(shape=dogs.shape, dtype=numpy.uint8)
+    ns, ny, nx = dogs.shape
+    if n_5:
+        neighbours = NEIGHBOURS_5
+        border = 2
+    else:
+        neighbours = NEIGHBOURS_3
+        border = 1
+    is_max = numpy.zeros(shape=dogs.shape, dtype=bool)
+    if ns < 3 or ny <= 2 * border or nx <= 2 * border:
+        return is_max
+    # NB: a candidate pre-selection with scipy.ndimage.maximum_filter followed
+    # by an exact check is correct but 2 to 4x slower than this tiled loop
+    # with early exit: most pixels are rejected by the first comparisons.
+    scratch = numpy.empty((tile, tile), dtype=bool)
     for i in range(1, ns - 1):
-        cur_dog = dogs[i]
-        next_dog = dogs[i + 1]
-        prev_dog = dogs[i - 1]
-        slic = cur_dog[1:-1, 1:-1]
-        kpm = kpma[i]
-        kpm[1:-1, 1:-1] += (slic > cur_dog[:-2, 1:-1]) * (slic > cur_dog[2:, 1:-1])
-        kpm[1:-1, 1:-1] += (slic > cur_dog[1:-1, :-2]) * (slic > cur_dog[1:-1, 2:])
-        kpm[1:-1, 1:-1] += (slic > cur_dog[:-2, :-2]) * (slic > cur_dog[2:, 2:])
-        kpm[1:-1, 1:-1] += (slic > cur_dog[2:, :-2]) * (slic > cur_dog[:-2, 2:])
-
-        #with next DoG
-        kpm[1:-1, 1:-1] += (slic > next_dog[:-2, 1:-1]) * (slic > next_dog[2:, 1:-1])
-        kpm[1:-1, 1:-1] += (slic > next_dog[1:-1, :-2]) * (slic > next_dog[1:-1, 2:])
-        kpm[1:-1, 1:-1] += (slic > next_dog[:-2, :-2]) * (slic > next_dog[2:, 2:])
-        kpm[1:-1, 1:-1] += (slic > next_dog[2:, :-2]) * (slic > next_dog[:-2, 2:])
-        kpm[1:-1, 1:-1] += (slic >= next_dog[1:-1, 1:-1])
-
-        #with previous DoG
-        kpm[1:-1, 1:-1] += (slic > prev_dog[:-2, 1:-1]) * (slic > prev_dog[2:, 1:-1])
-        kpm[1:-1, 1:-1] += (slic > prev_dog[1:-1, :-2]) * (slic > prev_dog[1:-1, 2:])
-        kpm[1:-1, 1:-1] += (slic > prev_dog[:-2, :-2]) * (slic > prev_dog[2:, 2:])
-        kpm[1:-1, 1:-1] += (slic > prev_dog[2:, :-2]) * (slic > prev_dog[:-2, 2:])
-        kpm[1:-1, 1:-1] += (slic >= prev_dog[1:-1, 1:-1])
-
-
-        if n_5:
-            target = 38
-            slic = cur_dog[2:-2, 2:-2]
-
-            kpm[2:-2, 2:-2] += (slic > cur_dog[:-4, 2:-2]) * (slic > cur_dog[4:, 2:-2]) #decalage horizontal
-            kpm[2:-2, 2:-2] += (slic > cur_dog[2:-2, :-4]) * (slic > cur_dog[2:-2, 4:]) #decalage vertical
-            kpm[2:-2, 2:-2] += (slic > cur_dog[:-4, :-4]) * (slic > cur_dog[4:, 4:])   #diagonale
-            kpm[2:-2, 2:-2] += (slic > cur_dog[4:, :-4]) * (slic > cur_dog[:-4, 4:])
-            kpm[2:-2, 2:-2] += (slic > cur_dog[4:, 1:-3]) * (slic > cur_dog[:-4, 1:-3])
-            kpm[2:-2, 2:-2] += (slic > cur_dog[1:-3, :-4]) * (slic > cur_dog[1:-3, 4:])
-            kpm[2:-2, 2:-2] += (slic > cur_dog[3:-1, :-4]) * (slic > cur_dog[3:-1, 4:])
-            kpm[2:-2, 2:-2] += (slic > cur_dog[4:, 3:-1]) * (slic > cur_dog[:-4, 3:-1])
-
-            #with next DoG
-            kpm[2:-2, 2:-2] += (slic > next_dog[:-4, 2:-2]) * (slic > next_dog[4:, 2:-2])
-            kpm[2:-2, 2:-2] += (slic > next_dog[2:-2, :-4]) * (slic > next_dog[2:-2, 4:])
-            kpm[2:-2, 2:-2] += (slic > next_dog[:-4, :-4]) * (slic > next_dog[4:, 4:])
-            kpm[2:-2, 2:-2] += (slic > next_dog[4:, :-4]) * (slic > next_dog[:-4, 4:])
-            kpm[2:-2, 2:-2] += (slic > next_dog[4:, 1:-3]) * (slic > next_dog[:-4, 1:-3])
-            kpm[2:-2, 2:-2] += (slic > next_dog[1:-3, :-4]) * (slic > next_dog[1:-3, 4:])
-            kpm[2:-2, 2:-2] += (slic > next_dog[3:-1, :-4]) * (slic > next_dog[3:-1, 4:])
-            kpm[2:-2, 2:-2] += (slic > next_dog[4:, 3:-1]) * (slic > next_dog[:-4, 3:-1])
-
-            #with previous DoG
-            kpm[2:-2, 2:-2] += (slic > prev_dog[:-4, 2:-2]) * (slic > prev_dog[4:, 2:-2])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[2:-2, :-4]) * (slic > prev_dog[2:-2, 4:])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[:-4, :-4]) * (slic > prev_dog[4:, 4:])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[4:, :-4]) * (slic > prev_dog[:-4, 4:])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[4:, 1:-3]) * (slic > prev_dog[:-4, 1:-3])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[1:-3, :-4]) * (slic > prev_dog[1:-3, 4:])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[3:-1, :-4]) * (slic > prev_dog[3:-1, 4:])
-            kpm[2:-2, 2:-2] += (slic > prev_dog[4:, 3:-1]) * (slic > prev_dog[:-4, 3:-1])
+        for y0 in range(border, ny - border, tile):
+            y1 = min(y0 + tile, ny - border)
+            for x0 in range(border, nx - border, tile):
+                x1 = min(x0 + tile, nx - border)
+                # all arrays are views of the same shape: the center and its shifted neighbours
+                center = dogs[i, y0:y1, x0:x1]
+                keep = is_max[i, y0:y1, x0:x1]
+                # masked pixels are discarded before any comparison
+                if mask is None:
+                    keep[...] = True
+                else:
+                    numpy.equal(mask[y0:y1, x0:x1], 0, out=keep)
+                    if not keep.any():
+                        continue
+                tmp = scratch[:y1 - y0, :x1 - x0]
+                for idx, (ds, dy, dx) in enumerate(neighbours):
+                    neighbour = dogs[i + ds, y0 + dy:y1 + dy, x0 + dx:x1 + dx]
+                    numpy.greater(center, neighbour, out=tmp)
+                    keep &= tmp
+                    # most candidates are discarded by the first comparisons
+                    if idx % 4 == 3 and not keep.any():
+                        break
+    return is_max
+
+
+class KeyPointList(object):
+    """
+    Growable list of keypoints, stored column-wise as float32 arrays:
+    one row per field (x, y, scale, I) instead of an array of records.
+    """
+    FIELDS = ("x", "y", "scale", "I")
 
-        else:
-            target = 14
-        if mask is not None:
-            kpm += mask
-    return kpms == target
+    def __init__(self):
+        self._data = numpy.empty((len(self.FIELDS), 0), dtype=numpy.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    x = property(lambda self: self._data[0, :self.size])
+    y = property(lambda self: self._data[1, :self.size])
+    scale = property(lambda self: self._data[2, :self.size])
+    I = property(lambda self: self._data[3, :self.size])
+
+    def extend(self, x, y, scale, I):
+        """
+        Append keypoints, the capacity is doubled when exceeded
+
+        @param x, y, scale, I: 1D arrays of the same length
+        """
+        l = len(x)
+        new_size = self.size + l
+        if new_size > self._data.shape[1]:
+            capacity = max(new_size, 2 * self._data.shape[1])
+            data = numpy.empty((len(self.FIELDS), capacity), dtype=numpy.float32)
+            data[:, :self.size] = self._data[:, :self.size]
+            self._data = data
+        for idx, values in enumerate((x, y, scale, I)):
+            self._data[idx, self.size:new_size] = values
+        self.size = new_size
+
+    def trim(self):
+        """
+        Release the unused capacity, once all octaves have been processed
+        """
+        if self._data.shape[1] > self.size:
+            self._data = self._data[:, :self.size].copy()
+
+
+def downscale(img, average=True):
+    """
+    Halve the size of an image in one pass over the 4 strided sub-images,
+    the last row/column is dropped when the size is odd.
+
+    @param img: 2D array
+    @param average: average the 2x2 blocks (float32), else logical or of them (int8)
+    @return: 2D array with half the size
+    """
+    ny = img.shape[0] // 2 * 2
+    nx = img.shape[1] // 2 * 2
+    a, b, c, d = img[0:ny:2, 0:nx:2], img[1:ny:2, 0:nx:2], img[0:ny:2, 1:nx:2], img[1:ny:2, 1:nx:2]
+    if not average:
+        return ((a != 0) | (b != 0) | (c != 0) | (d != 0)).astype(numpy.int8)
+    out = numpy.add(a, b, dtype=numpy.float32)
+    out += c
+    out += d
+    out *= 0.25
+    return out
+
+
+_DISKS = {}  # key=radius, value: structuring element
+def structuring_element(radius):
+    """
+    Disk used to dilate the mask, built once per radius
+
+    @param radius: radius of the disk in pixels (int)
+    @return: the radius itself for pyFAI's morphology, else a 2D boolean array
+    """
+    if pyFAI_morphology:
+        return radius
+    if radius not in _DISKS:
+        my, mx = numpy.ogrid[-radius:radius + 1, -radius:radius + 1]
+        _DISKS[radius] = (mx * mx + my * my) <= radius * radius
+    return _DISKS[radius]
+
+
+_DILATED_MASKS = {}  # key=(crc32, shape, grow), value: (mask, dilated mask)
+def dilated_mask(mask, grow):
+    """
+    Dilation of the mask, kept for the next images using the same mask:
+    a series of frames is dilated once. Only the last few masks are kept.
+
+    @param mask: 2D array of int8, non zero for invalid pixels
+    @param grow: radius of the dilation in pixels (int)
+    @return: 2D array, shared by the detections using this mask: not to be modified
+    """
+    key = (crc32(mask), mask.shape, grow)
+    cached = _DILATED_MASKS.get(key)
+    if (cached is None) or not numpy.array_equal(cached[0], mask):
+        if len(_DILATED_MASKS) >= 4:
+            _DILATED_MASKS.clear()
+        dilated = morphology.binary_dilation(mask, structuring_element(grow))
+        cached = _DILATED_MASKS[key] = (mask.copy(), dilated)
+    return cached[1]
 
 
 class BlobDetection(object):
     """
     
     """
-    def __init__(self, img, cur_sigma=0.25, init_sigma=0.50, dest_sigma=1, scale_per_octave=2, mask=None):
+    def __init__(self, img, cur_sigma=0.25, init_sigma=0.50, dest_sigma=1, scale_per_octave=2, mask=None, use_gpu=False):
         """
         Performs a blob detection:
         http://en.wikipedia.org/wiki/Blob_detection
@@ -133,64 +232,73 @@ class BlobDetection(object):
         @param dest_sigma: sigma at which the resolution is lowered (change of octave)
         @param scale_per_octave: Number of scale to be performed per octave
         @param mask: mask where pixel are not valid
+        @param use_gpu: process the octaves (blurs, DoG and local maxima) with OpenCL on the most powerful device
         """
         self.raw = numpy.log(img.astype(numpy.float32))
         self.cur_sigma = float(cur_sigma)
         self.init_sigma = float(init_sigma)
         self.dest_sigma = float(dest_sigma)
         self.scale_per_octave = int(scale_per_octave)
-        if mask is not None:
-            self.mask = (mask != 0).astype(numpy.int8)
-        else:
-            self.mask = (img <= 0).astype(numpy.int8)
-        #mask out the border of the image
-        self.mask[0, :] = 1
-        self.mask[-1, :] = 1
-        self.mask[:, 0] = 1
-        self.mask[:, -1] = 1
-        to_mask = numpy.where(self.mask)
-        self.do_mask = to_mask[0].size > 0
-        if self.do_mask:
-            self.raw[to_mask] = 0
-
-            #initial grow of 4*sigma_dest ... subsequent re-grow of half
-            grow = int(4.0 * self.dest_sigma)
-            if not pyFAI_morphology:
-                my, mx = numpy.ogrid[-grow:grow + 1, -grow:grow + 1]
-                grow = (mx * mx + my * my) <= grow * grow
-            self.cur_mask = morphology.binary_dilation(self.mask, grow)
-            #subsequent grow
-            grow = int(2.0 * self.dest_sigma)
-            if not pyFAI_morphology:
-                my, mx = numpy.ogrid[-grow:grow + 1, -grow:grow + 1]
-                grow = (mx * mx + my * my) <= grow * grow
-            self.grow = grow
+        self.set_mask(mask if mask is not None else img <= 0)
 
         self.data = None    # current image
         self.sigmas = None  # contains pairs of absolute sigma and relative ones...
-        self.blurs = []     # different blurred images
         self.dogs = []      # different difference of gaussians
         self.dogs_init = []
         self.border_size = 5# size of the border, unused: prefer mask
-        self.keypoints = []
+        self.keypoints = KeyPointList()
         self.delta = []
         self.sigma_octave = 1.0
+        self.curr_reduction = 1.0
+        self.octave = 0
+        self.ocl = None
+        if use_gpu:
+            if OCLBlob is None:
+                logger.warning("OpenCL is not available: blob detection falls back on the CPU")
+            else:
+                # the blurs are the same in all octaves: their filters are uploaded once
+                self._calc_sigma()
+                self.ocl = OCLBlob(sigmas=[sigma_rel for sigma_abs, sigma_rel in self.sigmas if sigma_rel != 0])
+
+    def set_mask(self, mask):
+        """
+        Define the invalid pixels, the border of the image being always masked.
+        The image itself is not modified: the mask is applied by _initial_blur.
+
+        The dilation of the mask is reused when the same mask was already set,
+        which avoids a dilation per frame when processing a series of images.
+
+        @param mask: array with non zero for invalid pixels, same shape as the image
+        """
+        self.mask = (mask != 0).astype(numpy.int8)
+        #mask out the border of the image
+        self.mask[[0, -1], :] = 1
+        self.mask[:, [0, -1]] = 1
+        # the border is always masked
+        self.do_mask = True
+
+        #initial grow of 4*sigma_dest ... subsequent re-grow of half
+        self.cur_mask = dilated_mask(self.mask, int(4.0 * self.dest_sigma))
+        #subsequent grow
+        self.grow = structuring_element(int(2.0 * self.dest_sigma))
 
     def _initial_blur(self):
         """
-        Blur the original image to achieve the requested level of blur init_sigma
+        Blur the original image to achieve the requested level of blur init_sigma,
+        the masked pixels being set to 0
         """
+        data = numpy.where(self.mask != 0, numpy.float32(0), self.raw)
         if self.init_sigma > self.cur_sigma:
             sigma = sqrt(self.init_sigma * self.init_sigma - self.cur_sigma * self.cur_sigma)
-            self.data = gaussian_filter(self.raw, sigma)
+            self.data = gaussian_filter(data, sigma)
         else:
-            self.data = self.raw
+            self.data = data
 
     def _calc_sigma(self):
         """
         Calculate all sigma to blur an image within an octave
         """
-        if not self.data:
+        if self.data is None:
             self._initial_blur()
         previous = self.init_sigma
         incr = 0
@@ -200,7 +308,7 @@ class BlobDetection(object):
             increase = previous * sqrt((self.dest_sigma / self.init_sigma) ** (2.0 / self.scale_per_octave) - 1.0)
             self.sigmas.append((sigma_abs, increase))
             previous = sigma_abs
-        print(self.sigmas)
+        logger.debug("Sigmas: %s", self.sigmas)
 
 
     @timeit
@@ -216,152 +324,135 @@ class BlobDetection(object):
         y = []
         dx = []
         dy = []
-        if not self.sigmas:
+        if self.sigmas is None:
             self._calc_sigma()
-        print(self.sigmas)
         
-        previous = self.data
-        dog_shape = (len(self.sigmas) - 1,) + self.data.shape
-        self.dogs = numpy.zeros(dog_shape, dtype=numpy.float32)
-
-        idx = 0
-        for sigma_abs, sigma_rel in self.sigmas:
-            if  sigma_rel == 0:
-                self.blurs.append(previous)
+        if self.ocl is not None:
+            self.dogs, valid_points, shrink_src = self.ocl.octave(self.data, self.sigmas, self.cur_mask,
+                                                                  n_5, self.scale_per_octave)
+        else:
+            previous = self.data
+            dog_shape = (len(self.sigmas) - 1,) + self.data.shape
+            self.dogs = numpy.zeros(dog_shape, dtype=numpy.float32)
+
+            # only the blurred image used to seed the next octave is kept
+            shrink_src = previous
+            idx = 0
+            for sigma_abs, sigma_rel in self.sigmas:
+                if sigma_rel != 0:
+                    new_blur = gaussian_filter(previous, sigma_rel)
+                    numpy.subtract(previous, new_blur, out=self.dogs[idx])
+                    previous = new_blur
+                    idx += 1
+                    if idx == self.scale_per_octave:
+                        shrink_src = new_blur
+
+            if _blob:
+                valid_points = _blob.local_max(self.dogs, self.cur_mask, n_5)
             else:
-                new_blur = gaussian_filter(previous, sigma_rel)
-                self.blurs.append(new_blur)
-                self.dogs[idx] = previous - new_blur
-                previous = new_blur
-                idx += 1
-
+                valid_points = local_max(self.dogs, self.cur_mask, n_5)
 
         if self.dogs[0].shape == self.raw.shape:
             self.dogs_init = self.dogs
 
-        if _blob:
-            valid_points = _blob.local_max(self.dogs, self.cur_mask, n_5)
-        else:
-            valid_points = local_max(self.dogs, self.cur_mask, n_5)
         kps, kpy, kpx = numpy.where(valid_points)
         
         l = kpx.size
         
         if do_SG4:
 
-            print ('Before refinement : %i keypoints' % l)
+            logger.debug("Before refinement : %i keypoints", l)
             kpx,kpy,kps,delta_s = self.refine_Hessian(kpx,kpy,kps)  
             l = kpx.size
-            print ('After refinement : %i keypoints' % l)  
+            logger.debug("After refinement : %i keypoints", l)
+        else:
+            delta_s = numpy.zeros(l)
 
         
-        dtype = numpy.dtype([('x', numpy.float32), ('y', numpy.float32), ('scale', numpy.float32), ('I', numpy.float32)])
-        keypoints = numpy.recarray((l,), dtype=dtype)
         sigmas = numpy.array([s[0] for s in self.sigmas])
+        self.keypoints.extend(kpx * self.curr_reduction,
+                              kpy * self.curr_reduction,
+                              kps + delta_s ** 2,  # scale = sigma^2
+                              self.dogs[(kps, numpy.around(kpy).astype(int), numpy.around(kpx).astype(int))])
 
-        
-        keypoints[:].x = kpx * self.curr_reduction
-        keypoints[:].y = kpy * self.curr_reduction
-        keypoints[:].scale = (kps + delta_s ** 2)  #scale = sigma^2
-        keypoints[:].I = self.dogs[(kps, numpy.around(kpy).astype(int), numpy.around(kpx).astype(int))]
-        
         if shrink:
             #shrink data so that they can be treated by next octave
-            print("In shrink")
-            self.data = binning(self.blurs[self.scale_per_octave], 2) / 4.0
+            self.data = downscale(shrink_src)
             self.curr_reduction *= 2
-            self.blurs = []
             if self.do_mask:
-                self.cur_mask = (binning(self.cur_mask, 2) > 0).astype(numpy.int8)
+                self.cur_mask = downscale(self.cur_mask, average=False)
                 self.cur_mask = morphology.binary_dilation(self.cur_mask, self.grow)
             self.octave += 1    
                 
-        if len(self.keypoints) == 0 : 
-            self.keypoints = keypoints 
-        else:
-            old_size = self.keypoints.size
-            new_size = old_size + l
-            self.keypoints.resize(new_size)
-            self.keypoints[old_size:] = keypoints  
-            
-#             self.keypoints = numpy.concatenate((self.keypoints, keypoints))
-#         self.keypoints = keypoints 
-
-  
-    def refine_Hessian(self,kpx,kpy,kps):
-        """ Savitzky Golay algorithm to check if a point is really the maximum """
 
+    def refine_Hessian(self, kpx, kpy, kps):
+        """
+        Savitzky Golay algorithm to check if a point is really the maximum
 
-        deltas = []
-        k2x=[]
-        k2y=[]
-        sigmas=[]
-        i=0
-
-        
+        All keypoints are processed at once: the 3x3 patches are gathered
+        into (N, 9) arrays and the N 3x3 systems are solved in a single call.
+        """
         #Hessian patch 3
-        SGX0Y0   =  [-0.11111111 ,0.22222222 ,-0.11111111 ,0.22222222 ,0.55555556 ,0.22222222 ,-0.11111111 ,0.22222222 ,-0.11111111]
-        SGX1Y0   =  [-0.16666667 ,0.00000000 ,0.16666667 ,-0.16666667 ,0.00000000 ,0.16666667 ,-0.16666667 ,0.00000000 ,0.16666667 ]
-        SGX2Y0   =  [0.16666667 ,-0.33333333 ,0.16666667 ,0.16666667 ,-0.33333333 ,0.16666667 ,0.16666667,-0.33333333,0.16666667 ]
-        SGX0Y1   =  [-0.16666667,-0.16666667,-0.16666667,0.00000000,0.00000000,0.00000000,0.16666667,0.16666667,0.16666667]
-        SGX1Y1   =  [0.25000000,0.00000000,-0.25000000,0.00000000,0.00000000,0.00000000,-0.25000000,0.00000000,0.25000000]
-        SGX0Y2   =  [0.16666667 ,0.16666667 ,0.16666667 ,-0.33333333 ,-0.33333333 ,-0.33333333 ,0.16666667 ,0.16666667 ,0.16666667]
+        SGX0Y0 = numpy.array([-0.11111111, 0.22222222, -0.11111111, 0.22222222, 0.55555556, 0.22222222, -0.11111111, 0.22222222, -0.11111111])
+        SGX1Y0 = numpy.array([-0.16666667, 0.00000000, 0.16666667, -0.16666667, 0.00000000, 0.16666667, -0.16666667, 0.00000000, 0.16666667])
+        SGX2Y0 = numpy.array([0.16666667, -0.33333333, 0.16666667, 0.16666667, -0.33333333, 0.16666667, 0.16666667, -0.33333333, 0.16666667])
+        SGX0Y1 = numpy.array([-0.16666667, -0.16666667, -0.16666667, 0.00000000, 0.00000000, 0.00000000, 0.16666667, 0.16666667, 0.16666667])
+        SGX1Y1 = numpy.array([0.25000000, 0.00000000, -0.25000000, 0.00000000, 0.00000000, 0.00000000, -0.25000000, 0.00000000, 0.25000000])
+        SGX0Y2 = numpy.array([0.16666667, 0.16666667, 0.16666667, -0.33333333, -0.33333333, -0.33333333, 0.16666667, 0.16666667, 0.16666667])
+
+        kpx = numpy.asarray(kpx)
+        kpy = numpy.asarray(kpy)
+        kps = numpy.asarray(kps)
+        with numpy.errstate(divide="ignore"):
+            j = numpy.round(numpy.log(kps / self.sigmas[0][0]) / numpy.log(2) * self.scale_per_octave)
+        ny, nx = self.dogs.shape[1:]
+        valid = (j > 0) & (j < self.scale_per_octave + 1) & \
+                (kpx > 1) & (kpx < nx - 2) & (kpy > 1) & (kpy < ny - 2)
+        x = kpx[valid]
+        y = kpy[valid]
+        sigma = kps[valid]
+        j = j[valid].astype(int)[:, numpy.newaxis]
+
+        # (N, 9) patches, in the same order as patch.ravel()
+        oy, ox = numpy.mgrid[-1:2, -1:2]
+        py = y[:, numpy.newaxis] + oy.ravel()
+        px = x[:, numpy.newaxis] + ox.ravel()
+        patch3 = self.dogs[j, py, px]
+        patch3_prev = self.dogs[j - 1, py, px]
+        patch3_next = self.dogs[j + 1, py, px]
+
+        dx = patch3.dot(SGX1Y0)
+        dy = patch3.dot(SGX0Y1)
+        d2x = patch3.dot(SGX2Y0)
+        d2y = patch3.dot(SGX0Y2)
+        dxy = patch3.dot(SGX1Y1)
+
+        s_next = patch3_next.dot(SGX0Y0)
+        s = patch3.dot(SGX0Y0)
+        s_prev = patch3_prev.dot(SGX0Y0)
+        d2s = (s_next + s_prev - 2.0 * s) / 4.0
+        ds = (s_next - s_prev) / 2.0
+
+        dxs = (patch3_next.dot(SGX1Y0) - patch3_prev.dot(SGX1Y0)) / 2.0
+        dys = (patch3_next.dot(SGX0Y1) - patch3_prev.dot(SGX0Y1)) / 2.0
+
+        lap = numpy.empty((x.size, 3, 3))
+        lap[:, 0, 0] = d2y
+        lap[:, 0, 1] = lap[:, 1, 0] = dxy
+        lap[:, 0, 2] = lap[:, 2, 0] = dys
+        lap[:, 1, 1] = d2x
+        lap[:, 1, 2] = lap[:, 2, 1] = dxs
+        lap[:, 2, 2] = d2s
+        grad = numpy.column_stack((dy, dx, ds))[:, :, numpy.newaxis]
+        delta = numpy.linalg.solve(lap, grad)[:, :, 0] if x.size else grad[:, :, 0]
+        err = numpy.sqrt((delta[:, :2] ** 2).sum(axis=1))
+
+        good = (err < numpy.sqrt(2)) & (abs(delta[:, 0]) <= 1.0) & (abs(delta[:, 1]) <= 1.0) & \
+               (sigma + delta[:, 2] <= 8)
+        return x[good] - delta[good, 1], y[good] - delta[good, 0], sigma[good], delta[good, 2]
 
-        for y,x,sigma in itertools.izip(kpy,kpx,kps):
-            
 
-            j = round(numpy.log(sigma/self.sigmas[0][0])/numpy.log(2)*self.scale_per_octave)
 
-            if j > 0 and j < self.scale_per_octave+1:
-                curr_dog = self.dogs[j]
-                prev_dog = self.dogs[j-1]
-                next_dog = self.dogs[j+1]
-
-                if (x > 1 and x < curr_dog.shape[1]-2 and y > 1 and y < curr_dog.shape[0]-2):
-                
-                    
-                    patch3 = curr_dog[y-1:y+2,x-1:x+2]
-                    patch3_prev = prev_dog[y-1:y+2,x-1:x+2]
-                    patch3_next = next_dog[y-1:y+2,x-1:x+2]
-    
-                    dx = (SGX1Y0*patch3.ravel()).sum()
-                    dy = (SGX0Y1*patch3.ravel()).sum()
-                    d2x = (SGX2Y0*patch3.ravel()).sum()
-                    d2y = (SGX0Y2*patch3.ravel()).sum()
-                    dxy = (SGX1Y1*patch3.ravel()).sum()
-    
-                    s_next = (SGX0Y0*patch3_next.ravel()).sum()
-                    s = (SGX0Y0*patch3.ravel()).sum()
-                    s_prev = (SGX0Y0*patch3_prev.ravel()).sum()
-                    d2s = (s_next + s_prev - 2.0*s) /4.0
-                    ds = (s_next - s_prev) /2.0
-                    
-                    dx_next = (SGX1Y0*patch3_next.ravel()).sum()
-                    dx_prev = (SGX1Y0*patch3_prev.ravel()).sum()
-                    
-                    dy_next = (SGX0Y1*patch3_next.ravel()).sum()
-                    dy_prev = (SGX0Y1*patch3_prev.ravel()).sum()
-                    
-                    dxs = (dx_next - dx_prev)/2.0
-                    dys = (dy_next - dy_prev)/2.0                
-                                    
-                    lap = numpy.array([[d2y,dxy,dys],[dxy,d2x,dxs],[dys,dxs,d2s]])
-    
-                    delta = (numpy.dot(numpy.linalg.inv(lap),[dy,dx,ds]))
-                    err = numpy.linalg.norm(delta[:-1])
-                    
-                    if  err < numpy.sqrt(2) and numpy.abs(delta[0]) <= 1.0 and numpy.abs(delta[1]) <= 1.0 and numpy.abs(sigma+delta[2] <= 8) :
-                        k2x.append(x-delta[1])
-                        k2y.append(y-delta[0])
-                        sigmas.append(sigma)
-                        deltas.append(delta[2])
-
-                    i = i + 1
-          
-        return numpy.asarray(k2x),numpy.asarray(k2y),numpy.asarray(sigmas),numpy.asarray(deltas)
-                 
-                
-        
 if __name__ == "__main__":
 
     kx = []
@@ -381,11 +472,11 @@ if __name__ == "__main__":
 #     img = image_test()
 
     bd = BlobDetection(img)
-    kx, ky, dx, dy, sigma = bd._one_octave()
+    bd._one_octave()
     print bd.sigmas
 
     #building histogram with the corrected sigmas
-    sigma = numpy.asarray(sigma)
+    sigma = bd.keypoints.scale
     pylab.figure(2)
     pylab.clf()
     pylab.hist(sigma, bins=500)
@@ -427,13 +518,10 @@ if __name__ == "__main__":
     print 'sigma pour la separation'
     print h[1][index]
 #  building arrays x and y containing all the coordinates of the keypoints, only for vizualisation
-    x = []
-    y = []
+    # keypoints are stored column-wise
+    x = bd.keypoints.x
+    y = bd.keypoints.y
     print bd.keypoints.__len__()
-    for j in range(bd.keypoints.__len__()):
-        k = bd.keypoints[j]
-        x.extend(numpy.transpose(k)[0])
-        y.extend(numpy.transpose(k)[1])
 
 
     print x.__len__(), y.__len__(), kx.__len__(), ky.__len__()
@@ -37,6 +37,7 @@ Module containing the description of all detectors with a factory to instanciate
 import os
 import logging
 import threading
+import functools
 import numpy
 
 logger = logging.getLogger("pyFAI.detectors")
@@ -51,9 +52,211 @@ try:
     import fabio
 except ImportError:
     fabio = None
+try:
+    intern
+except NameError:  # Python 3
+    from sys import intern
 epsilon = 1e-6
 
 
+def _pixel_size(value):
+    """
+    Convert a pixel size, given as a number or as a sequence, to a float
+
+    @param value: pixel size in meter
+    @return: pixel size as a python float
+    """
+    if isinstance(value, (tuple, list)):
+        value = value[0]
+    return float(value)
+
+
+def _pixel_positions(pixel, delta, index, shape, dtype, out=None, scale=None):
+    """
+    Calculate pixel * (scale * delta + 0.5 + index) directly into the result,
+    without temporary arrays, the inputs being broadcast to the shape of the result.
+
+    @param pixel: size of the pixel in meter
+    @param delta: displacement in pixel (ndarray or scalar)
+    @param index: pixel coordinate (ndarray)
+    @param shape: shape of the result
+    @param dtype: type of the result
+    @param out: array of the right shape where to write the result, allocated if None
+    @param scale: factor converting delta to pixels, if not already in pixels
+    @return: position in meter as an array of the given shape and type
+    """
+    if out is None:
+        result = numpy.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError("Output array has shape %s, expected %s" % (out.shape, shape))
+    else:
+        result = out
+    if (numpy.ndim(delta) == 0) and (numpy.size(index) < result.size):
+        # no displacement: positions are computed once per row (or column)
+        # and broadcast, the result is written in a single pass
+        if scale is not None:
+            delta = delta * scale
+        result[...] = (numpy.asarray(index, dtype=numpy.float64) + (delta + 0.5)) * pixel
+        return result
+    if scale is None:
+        numpy.add(delta, index, out=result, casting="unsafe")
+    else:
+        # delta keeps its (integer) type until it is written in the result
+        numpy.multiply(delta, scale, out=result, casting="unsafe")
+        result += index
+    result += 0.5
+    result *= pixel
+    return result
+
+
+def _binning_factors(bin_size):
+    """
+    Normalise a binning given as a number or as a sequence to a couple of integers
+
+    @param bin_size: binning factor, int or (int, int)
+    @return: (binning along dim1, binning along dim2) as integers
+    """
+    if isinstance(bin_size, (int, float)):
+        b = int(round(bin_size))
+        return (b, b)
+    if hasattr(bin_size, "__len__") and len(bin_size) >= 2:
+        return int(round(float(bin_size[0]))), int(round(float(bin_size[1])))
+    b = int(round(float(bin_size)))
+    return (b, b)
+
+
+def _file_key(filename):
+    """
+    Cheap signature of the content of a file, used to avoid reading
+    (and checksumming) again a file which did not change
+
+    @param filename: name of the file
+    @return: (absolute path, modification time, size) or None if the file cannot be accessed
+    """
+    try:
+        stat = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+
+def _gap_mask(shape, module_size, module_gap):
+    """
+    Mask of the gaps between the modules of a detector: a pixel is masked
+    when either its row or its column falls in a gap.
+
+    @param shape: shape of the detector
+    @param module_size: size of a module in pixels (y, x)
+    @param module_gap: size of the gap between modules in pixels (y, x)
+    @return: mask as int8 array with 1 for the gaps
+    """
+    gaps = []
+    for length, size, gap in zip(shape, module_size, module_gap):
+        # position within a period module + gap
+        gaps.append((numpy.arange(length) % (size + gap)) >= size)
+    return (gaps[0][:, numpy.newaxis] | gaps[1][numpy.newaxis, :]).astype(numpy.int8)
+
+
+_CIRCULAR_MASKS = {}  # key: shape, value: read-only mask
+
+
+def _circular_mask(shape):
+    """
+    Mask of the pixels outside the disk inscribed in the detector (imaging
+    plates, circular CCD). It depends only on the shape: it is calculated
+    once per shape and shared, read-only, by all detectors which hand out
+    copies of it.
+
+    @param shape: shape of the detector
+    @return: read-only boolean array, True outside the disk
+    """
+    shape = tuple(shape)
+    mask = _CIRCULAR_MASKS.get(shape)
+    if mask is None:
+        c = [i // 2 for i in shape]
+        # (x + 0.5 - c0)^2 + (y + 0.5 - c1)^2 > c0^2, multiplied by 4 to be
+        # exact in integers. The test is written x^2 > r^2 - y^2 so that only
+        # the two 1D terms are computed, and broadcast in the comparison:
+        # the mask is written in a single pass without any full size
+        # temporary, a compiled (Cython/OpenCL) kernel would not do less.
+        dx = 2 * numpy.arange(shape[0], dtype=numpy.int64) + 1 - 2 * c[0]
+        dy = 2 * numpy.arange(shape[1], dtype=numpy.int64) + 1 - 2 * c[1]
+        mask = (dx * dx)[:, numpy.newaxis] > (4 * c[0] * c[0] - dy * dy)[numpy.newaxis, :]
+        mask.flags.writeable = False
+        _CIRCULAR_MASKS[shape] = mask
+    return mask
+
+
+def _corner_offsets(offset1, offset2, shape):
+    """
+    Spread the offsets of the pixels (Pilatus distortion files) over the
+    corners of the pixels: each pixel gives its offset to its 4 corners,
+    corners already set are not overwritten.
+
+    @param offset1, offset2: offsets of the pixels in percent of pixel, shape (s0, s1)
+    @param shape: shape of the array of corners, larger than (s0, s1)
+    @return: delta1, delta2: offsets of the corners in percent of pixel, same type as the offsets
+    """
+    s0, s1 = offset1.shape
+    delta1 = numpy.zeros(shape, dtype=offset1.dtype)  # usually the integer type of the pilatus CBF
+    delta2 = numpy.zeros(shape, dtype=offset2.dtype)
+    delta1[:s0, :s1] = offset1
+    delta2[:s0, :s1] = offset2
+    for corner in ((slice(-s0, None), slice(None, s1)),
+                   (slice(-s0, None), slice(-s1, None)),
+                   (slice(None, s0), slice(-s1, None))):
+        # copy in place, without index arrays, where nothing has been set yet
+        empty = (delta1[corner] == 0)
+        numpy.copyto(delta1[corner], offset1, casting="unsafe", where=empty)
+        numpy.copyto(delta2[corner], offset2, casting="unsafe", where=empty)
+    return delta1, delta2
+
+
+def cache_full_grid(calc_cartesian_positions):
+    """
+    Decorator for calc_cartesian_positions: the positions of all the pixels
+    of a distorted detector (d1 and d2 are None, spline or offsets set) are
+    calculated once and kept until the pixel size, shape, binning or
+    distortion of the detector changes.
+
+    Without distortion, the regular grid is computed at each call: this is
+    faster than copying a cached one, and no memory is held.
+
+    The cached arrays are read-only and never handed out: the caller gets a
+    copy, or the positions written in out1/out2. The spline and the offset
+    arrays are part of the key by identity, they are replaced, not modified
+    in place.
+    """
+    @functools.wraps(calc_cartesian_positions)
+    def wrapper(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
+        if (d1 is not None) or (d2 is not None):
+            return calc_cartesian_positions(self, d1, d2, dtype, out1, out2)
+        distortion = (self.spline, getattr(self, "offset1", None), getattr(self, "offset2", None))
+        if all(i is None for i in distortion):
+            self._cartesian_cache = {}
+            return calc_cartesian_positions(self, d1, d2, dtype, out1, out2)
+        key = (tuple(self.max_shape), tuple(self._binning), self._pixel1, self._pixel2,
+               numpy.dtype(dtype).str, tuple(id(i) for i in distortion))
+        if key not in self._cartesian_cache:
+            positions = calc_cartesian_positions(self, d1, d2, dtype)
+            for ary in positions:
+                if isinstance(ary, numpy.ndarray):
+                    ary.flags.writeable = False
+            # the distortion objects are kept alive: their id can not be reused
+            self._cartesian_cache = {key: (positions, distortion)}
+        positions = self._cartesian_cache[key][0]
+        result = []
+        for ary, out in zip(positions, (out1, out2)):
+            if out is not None:
+                out[...] = ary
+                ary = out
+            elif isinstance(ary, numpy.ndarray):
+                ary = ary.copy()
+            result.append(ary)
+        return tuple(result)
+    return wrapper
+
+
 class DetectorMeta(type):
     """
     Metaclass used to register all detector classes inheriting from Detector
@@ -62,11 +265,12 @@ class DetectorMeta(type):
     # to modify attributes of the class *after* they have been
     # created
     def __init__(cls, name, bases, dct):
-        cls.registry[name.lower()] = cls
+        # keys are interned: lookups of interned names succeed on identity
+        cls.registry[intern(name.lower())] = cls
         if hasattr(cls, "aliases"):
             for alias in cls.aliases:
-                cls.registry[alias.lower().replace(" ", "_")] = cls
-                cls.registry[alias.lower().replace(" ", "")] = cls
+                cls.registry[intern(alias.lower().replace(" ", "_"))] = cls
+                cls.registry[intern(alias.lower().replace(" ", ""))] = cls
         super(DetectorMeta, cls).__init__(name, bases, dct)
 
 
@@ -92,9 +296,16 @@ class Detector(object):
         @return: an instance of the right detector, set-up if possible
         @rtype: pyFAI.detectors.Detector
         """
-        name = name.lower()
-        if name in cls.registry:
-            mydet = cls.registry[name]()
+        # same normalisation as the names registered by DetectorMeta
+        name = name.strip().lower().replace(" ", "_")
+        if isinstance(name, str):  # unicode can not be interned with Python 2
+            name = intern(name)
+        detector_class = cls.registry.get(name)
+        if detector_class is None:
+            # "Pilatus 1M" or "pilatus_1m" for the class Pilatus1M
+            detector_class = cls.registry.get(name.replace("_", ""))
+        if detector_class is not None:
+            mydet = detector_class()
             if config is not None:
                 mydet.set_config(config)
             return mydet
@@ -124,10 +335,12 @@ class Detector(object):
         self._mask = False
         self._mask_crc = None
         self._maskfile = None
+        self._maskfile_key = None  # (path, mtime, size) of the file the mask was read from
         self._splineFile = None
         self.spline = None
         self._splineCache = {}  # key=(dx,xpoints,ypoints) value: ndarray
-        self._sem = threading.Semaphore()
+        self._cartesian_cache = {}  # key=(shape, binning, pixel1, pixel2, dtype, distortion) value: ((p1, p2), distortion)
+        self._sem = threading.Lock()
         if splineFile:
             self.set_splineFile(splineFile)
 
@@ -168,6 +381,7 @@ class Detector(object):
         else:
             self._splineFile = None
             self.spline = None
+        self._cartesian_cache = {}
     splineFile = property(get_splineFile, set_splineFile)
 
     def get_binning(self):
@@ -180,7 +394,9 @@ class Detector(object):
         @param bin_size: binning as integer or tuple of integers.
         @type bin_size: (int, int)
         """
-        if "__len__" in dir(bin_size) and len(bin_size) >= 2:
+        if bin_size is self._binning:
+            return
+        if hasattr(bin_size, "__len__") and len(bin_size) >= 2:
             bin_size = (float(bin_size[0]), float(bin_size[1]))
         else:
             b = float(bin_size)
@@ -196,6 +412,7 @@ class Detector(object):
                 self._pixel1 *= ratioY
                 self._pixel2 *= ratioX
             self._binning = bin_size
+            self._cartesian_cache = {}
 
     binning = property(get_binning, set_binning)
 
@@ -254,7 +471,8 @@ class Detector(object):
             elif kw == "splineFile":
                 self.set_splineFile(kwarg[kw])
 
-    def calc_cartesian_positions(self, d1=None, d2=None):
+    @cache_full_grid
+    def calc_cartesian_positions(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
         """
         Calculate the position of each pixel center in cartesian coordinate
         and in meter of a couple of coordinates.
@@ -264,6 +482,8 @@ class Detector(object):
         @type d1: ndarray (1D or 2D)
         @param d2: the X pixel positions (fast dimension)
         @type d2: ndarray (1D or 2D)
+        @param dtype: type of the result, double precision by default (numpy.float32 halves the size of the arrays)
+        @param out1, out2: arrays where to write the positions (reused from frame to frame), allocated if None
 
         @return: position in meter of the center of each pixels.
         @rtype: ndarray
@@ -271,36 +491,60 @@ class Detector(object):
         d1 and d2 must have the same shape, returned array will have
         the same shape.
         """
+        full_grid = (d1 is None) and (d2 is None)
+        # index grids are broadcast rather than allocated
         if (d1 is None):
-            d1 = numpy.outer(numpy.arange(self.max_shape[0]), numpy.ones(self.max_shape[1]))
+            d1 = numpy.arange(self.max_shape[0], dtype=numpy.float64)[:, numpy.newaxis]
 
         if (d2 is None):
-            d2 = numpy.outer(numpy.ones(self.max_shape[0]), numpy.arange(self.max_shape[1]))
+            d2 = numpy.arange(self.max_shape[1], dtype=numpy.float64)[numpy.newaxis, :]
 
         if self.spline is None:
             dX = 0.
             dY = 0.
         else:
             if d2.ndim == 1:
-                keyX = ("dX", tuple(d1), tuple(d2))
-                keyY = ("dY", tuple(d1), tuple(d2))
-                if keyX not in self._splineCache:
-                    self._splineCache[keyX] = \
-                        numpy.array([self.spline.splineFuncX(i2, i1)
-                                     for i1, i2 in zip(d1 + 0.5, d2 + 0.5)],
-                                    dtype="float64")
-                if keyY not in self._splineCache:
-                    self._splineCache[keyY] = \
-                        numpy.array([self.spline.splineFuncY(i2, i1)
-                                     for i1, i2 in zip(d1 + 0.5, d2 + 0.5)],
-                                    dtype="float64")
+                d1 = numpy.ascontiguousarray(d1)
+                d2 = numpy.ascontiguousarray(d2)
+                key = (d1.shape, d1.dtype.str, crc32(d1), d2.dtype.str, crc32(d2))
+                keyX = ("dX",) + key
+                keyY = ("dY",) + key
+                if (keyX not in self._splineCache) or (keyY not in self._splineCache):
+                    # The spline is evaluated on the grid made of the distinct coordinates
+                    # and the points are picked in it: pixel coordinates have few distinct values
+                    x, ix = numpy.unique(d2 + 0.5, return_inverse=True)
+                    y, iy = numpy.unique(d1 + 0.5, return_inverse=True)
+                    if x.size * y.size <= max(16 * d1.size, 1 << 20):
+                        self._splineCache[keyX] = numpy.asarray(self.spline.splineFuncX(x, y), dtype="float64")[iy, ix]
+                        self._splineCache[keyY] = numpy.asarray(self.spline.splineFuncY(x, y), dtype="float64")[iy, ix]
+                    else:  # scattered points: one evaluation per point
+                        x = d2 + 0.5
+                        y = d1 + 0.5
+                        self._splineCache[keyX] = \
+                            numpy.fromiter((self.spline.splineFuncX(i2, i1) for i1, i2 in zip(y, x)),
+                                           dtype=numpy.float64, count=d1.size)
+                        self._splineCache[keyY] = \
+                            numpy.fromiter((self.spline.splineFuncY(i2, i1) for i1, i2 in zip(y, x)),
+                                           dtype=numpy.float64, count=d1.size)
+                dX = self._splineCache[keyX]
+                dY = self._splineCache[keyY]
+            elif full_grid:
+                # the displacement of the whole detector is evaluated once
+                keyX = ("dX", "grid") + tuple(self.max_shape)
+                keyY = ("dY", "grid") + tuple(self.max_shape)
+                if (keyX not in self._splineCache) or (keyY not in self._splineCache):
+                    x = numpy.arange(self.max_shape[1]) + 0.5
+                    y = numpy.arange(self.max_shape[0]) + 0.5
+                    self._splineCache[keyX] = self.spline.splineFuncX(x, y)
+                    self._splineCache[keyY] = self.spline.splineFuncY(x, y)
                 dX = self._splineCache[keyX]
                 dY = self._splineCache[keyY]
             else:
                 dX = self.spline.splineFuncX(d2 + 0.5, d1 + 0.5)
                 dY = self.spline.splineFuncY(d2 + 0.5, d1 + 0.5)
-        p1 = (self._pixel1 * (dY + 0.5 + d1))
-        p2 = (self._pixel2 * (dX + 0.5 + d2))
+        shape = numpy.broadcast(d1, d2).shape
+        p1 = _pixel_positions(self._pixel1, dY, d1, shape, dtype, out1)
+        p2 = _pixel_positions(self._pixel2, dX, d2, shape, dtype, out2)
         return p1, p2
 
     def calc_mask(self):
@@ -315,28 +559,53 @@ class Detector(object):
     # Few properties
     ############################################################################
     def get_mask(self):
-        if self._mask is False:
+        mask = self._mask
+        if mask is False:
             with self._sem:
-                if self._mask is False:
-                    self._mask = self.calc_mask()  # gets None in worse cases
-                    if self._mask is not None:
-                        self._mask_crc = crc32(self._mask)
-        return self._mask
+                mask = self._mask
+                if mask is False:
+                    mask = self.calc_mask()  # gets None in worse cases
+                    # the checksum is published before the mask: a reader
+                    # which does not take the lock never sees a stale one
+                    self._mask_crc = None if mask is None else crc32(mask)
+                    self._mask = mask
+        return mask
     def set_mask(self, mask):
+        crc = None if mask is None else crc32(mask)
         with self._sem:
+            self._mask_crc = crc
             self._mask = mask
-            if mask is not None:
-                self._mask_crc = crc32(mask)
-            else:
-                self._mask_crc = None
+            self._maskfile_key = None
     mask = property(get_mask, set_mask)
+
+    def calc_mask_packed(self):
+        """
+        Mask of the detector as a bitmap: 8 pixels per byte along the fastest
+        dimension, as given by numpy.packbits. It is 8 times smaller than the
+        mask, numpy.unpackbits(packed, axis=-1)[..., :shape[-1]] restores it.
+
+        @return: uint8 array or None if the detector has no mask
+        """
+        mask = self.get_mask()
+        if mask is None:
+            return None
+        return numpy.packbits(numpy.asarray(mask) != 0, axis=-1)
+
     def set_maskfile(self, maskfile):
         if fabio:
+            key = _file_key(maskfile)
+            if (key is not None) and (key == self._maskfile_key):
+                # same file, unchanged since it was read: keep mask and checksum
+                self._maskfile = maskfile
+                return
+            mask = numpy.ascontiguousarray(fabio.open(maskfile).data,
+                                           dtype=numpy.int8)
+            crc = crc32(mask)
             with self._sem:
-                self._mask = numpy.ascontiguousarray(fabio.open(maskfile).data,
-                                                     dtype=numpy.int8)
-                self._mask_crc = crc32(self._mask)
+                self._mask_crc = crc
+                self._mask = mask
                 self._maskfile = maskfile
+                self._maskfile_key = key
         else:
             logger.error("FabIO is not available, unable to load the image to set the mask.")
 
@@ -347,15 +616,10 @@ class Detector(object):
     def get_pixel1(self):
         return self._pixel1
     def set_pixel1(self, value):
-        if isinstance(value, float):
-            value = value
-        elif isinstance(value, (tuple, list)):
-            value = float(value[0])
-        else:
-            value = float(value)
-        if self._pixel1:
+        value = _pixel_size(value)
+        if self.force_pixel and self._pixel1:
             err = abs(value - self._pixel1) / self._pixel1
-            if self.force_pixel and  (err > epsilon):
+            if err > epsilon:
                 logger.warning("enforcing pixel size 2 for a detector %s" %
                                self.__class__.__name__)
         self._pixel1 = value
@@ -364,15 +628,10 @@ class Detector(object):
     def get_pixel2(self):
         return self._pixel2
     def set_pixel2(self, value):
-        if isinstance(value, float):
-            value = value
-        elif isinstance(value, (tuple, list)):
-            value = float(value[0])
-        else:
-            value = float(value)
-        if self._pixel2:
+        value = _pixel_size(value)
+        if self.force_pixel and self._pixel2:
             err = abs(value - self._pixel2) / self._pixel2
-            if self.force_pixel and  (err > epsilon):
+            if err > epsilon:
                 logger.warning("enforcing pixel size 2 for a detector %s" %
                                self.__class__.__name__)
         self._pixel2 = value
@@ -397,23 +656,20 @@ class Pilatus(Detector):
     """
     MODULE_SIZE = (195, 487)
     MODULE_GAP = (17, 7)
+    MAX_SHAPE = (None, None)  # defined by each model
     force_pixel = True
 
     def __init__(self, pixel1=172e-6, pixel2=172e-6, x_offset_file=None, y_offset_file=None):
         super(Pilatus, self).__init__(pixel1=pixel1, pixel2=pixel2)
+        self.max_shape = self.MAX_SHAPE
         self.x_offset_file = x_offset_file
         self.y_offset_file = y_offset_file
-        if self.x_offset_file and self.y_offset_file:
-            if fabio:
-                self.offset1 = fabio.open(self.y_offset_file).data
-                self.offset2 = fabio.open(self.x_offset_file).data
-            else:
-                logging.error("FabIO is not available: no distortion correction for Pilatus detectors, sorry.")
-                self.offset1 = None
-                self.offset2 = None
-        else:
-            self.offset1 = None
-            self.offset2 = None
+        # offsets are only read from the files when needed
+        self._offset1 = None
+        self._offset2 = None
+        self._offset_files_key = None  # signature of the files the offsets come from
+        if self.x_offset_file and self.y_offset_file and not fabio:
+            logging.error("FabIO is not available: no distortion correction for Pilatus detectors, sorry.")
 
     def __repr__(self):
         txt = "Detector %s\t PixelSize= %.3e, %.3e m" % \
@@ -424,28 +680,58 @@ class Pilatus(Detector):
             txt += "\t delta_y= %s" % self.y_offset_file
         return txt
 
+    def get_offset1(self):
+        """
+        Offsets along the slow dimension (Y) in percent of pixel, read on first access
+        """
+        if (self._offset1 is None) and self.y_offset_file and fabio:
+            self._offset1 = fabio.open(self.y_offset_file).data
+        return self._offset1
+    def set_offset1(self, value):
+        self._offset1 = value
+        self._offset_files_key = None
+        self._cartesian_cache = {}
+    offset1 = property(get_offset1, set_offset1)
+
+    def get_offset2(self):
+        """
+        Offsets along the fast dimension (X) in percent of pixel, read on first access
+        """
+        if (self._offset2 is None) and self.x_offset_file and fabio:
+            self._offset2 = fabio.open(self.x_offset_file).data
+        return self._offset2
+    def set_offset2(self, value):
+        self._offset2 = value
+        self._offset_files_key = None
+        self._cartesian_cache = {}
+    offset2 = property(get_offset2, set_offset2)
+
     def get_splineFile(self):
         if self.x_offset_file and self.y_offset_file:
             return "%s,%s" % (self.x_offset_file, self.y_offset_file)
 
     def set_splineFile(self, splineFile=None):
         "In this case splinefile is a couple filenames"
+        self._cartesian_cache = {}
         if splineFile is not None:
+            key = self._offset_files_key
+            offsets = (self._offset1, self._offset2)
+            self.offset1 = self.offset2 = None
             try:
                 files = splineFile.split(",")
                 self.x_offset_file = [os.path.abspath(i) for i in files if "x" in i.lower()][0]
                 self.y_offset_file = [os.path.abspath(i) for i in files if "y" in i.lower()][0]
             except Exception as error:
                 logger.error("set_splineFile with %s gave error: %s" % (splineFile, error))
-                self.x_offset_file = self.y_offset_file = self.offset1 = self.offset2 = None
+                self.x_offset_file = self.y_offset_file = None
                 return
-            if fabio:
-                self.offset1 = fabio.open(self.y_offset_file).data
-                self.offset2 = fabio.open(self.x_offset_file).data
-            else:
+            new_key = (_file_key(self.x_offset_file), _file_key(self.y_offset_file))
+            if (None not in new_key) and (new_key == key):
+                # same files, unchanged: keep the offsets already read
+                self._offset1, self._offset2 = offsets
+            self._offset_files_key = new_key
+            if not fabio:
                 logging.error("FabIO is not available: no distortion correction for Pilatus detectors, sorry.")
-                self.offset1 = None
-                self.offset2 = None
         else:
             self._splineFile = None
     splineFile = property(get_splineFile, set_splineFile)
@@ -457,18 +743,10 @@ class Pilatus(Detector):
         if (self.max_shape[0] or self.max_shape[1]) is None:
             raise NotImplementedError("Generic Pilatus detector does not know"
                                       "the max size ...")
-        mask = numpy.zeros(self.max_shape, dtype=numpy.int8)
-        # workinng in dim0 = Y
-        for i in range(self.MODULE_SIZE[0], self.max_shape[0],
-                       self.MODULE_SIZE[0] + self.MODULE_GAP[0]):
-            mask[i: i + self.MODULE_GAP[0], :] = 1
-        # workinng in dim1 = X
-        for i in range(self.MODULE_SIZE[1], self.max_shape[1],
-                       self.MODULE_SIZE[1] + self.MODULE_GAP[1]):
-            mask[:, i: i + self.MODULE_GAP[1]] = 1
-        return mask
+        return _gap_mask(self.max_shape, self.MODULE_SIZE, self.MODULE_GAP)
 
-    def calc_cartesian_positions(self, d1=None, d2=None):
+    @cache_full_grid
+    def calc_cartesian_positions(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
         """
         Calculate the position of each pixel center in cartesian coordinate
         and in meter of a couple of coordinates.
@@ -478,6 +756,8 @@ class Pilatus(Detector):
         @type d1: ndarray (1D or 2D)
         @param d2: the X pixel positions (fast dimension)
         @type d2: ndarray (1D or 2D)
+        @param dtype: type of the result, double precision by default (numpy.float32 halves the size of the arrays)
+        @param out1, out2: arrays where to write the positions (reused from frame to frame), allocated if None
 
         @return: position in meter of the center of each pixels.
         @rtype: ndarray
@@ -485,11 +765,12 @@ class Pilatus(Detector):
         d1 and d2 must have the same shape, returned array will have
         the same shape.
         """
+        # index grids are broadcast rather than allocated
         if (d1 is None):
-            d1 = numpy.outer(numpy.arange(self.max_shape[0]), numpy.ones(self.max_shape[1]))
+            d1 = numpy.arange(self.max_shape[0], dtype=numpy.float64)[:, numpy.newaxis]
 
         if (d2 is None):
-            d2 = numpy.outer(numpy.ones(self.max_shape[0]), numpy.arange(self.max_shape[1]))
+            d2 = numpy.arange(self.max_shape[1], dtype=numpy.float64)[numpy.newaxis, :]
 
         if self.offset1 is None or self.offset2 is None:
             delta1 = delta2 = 0.
@@ -497,35 +778,23 @@ class Pilatus(Detector):
             if d2.ndim == 1:
                 d1n = d1.astype(numpy.int32)
                 d2n = d2.astype(numpy.int32)
-                delta1 = self.offset1[d1n, d2n] / 100.0  # Offsets are in percent of pixel
-                delta2 = self.offset2[d1n, d2n] / 100.0
+                delta1 = self.offset1[d1n, d2n]
+                delta2 = self.offset2[d1n, d2n]
             else:
-                if d1.shape == self.offset1.shape:
-                    delta1 = self.offset1 / 100.0  # Offsets are in percent of pixel
-                    delta2 = self.offset2 / 100.0
-                elif d1.shape[0] > self.offset1.shape[0]:  # probably working with corners
-                    s0, s1 = self.offset1.shape
-                    delta1 = numpy.zeros(d1.shape, dtype=numpy.int32)  # this is the natural type for pilatus CBF
-                    delta2 = numpy.zeros(d2.shape, dtype=numpy.int32)
-                    delta1[:s0, :s1] = self.offset1
-                    delta2[:s0, :s1] = self.offset2
-                    mask = numpy.where(delta1[-s0:, :s1] == 0)
-                    delta1[-s0:, :s1][mask] = self.offset1[mask]
-                    delta2[-s0:, :s1][mask] = self.offset2[mask]
-                    mask = numpy.where(delta1[-s0:, -s1:] == 0)
-                    delta1[-s0:, -s1:][mask] = self.offset1[mask]
-                    delta2[-s0:, -s1:][mask] = self.offset2[mask]
-                    mask = numpy.where(delta1[:s0, -s1:] == 0)
-                    delta1[:s0, -s1:][mask] = self.offset1[mask]
-                    delta2[:s0, -s1:][mask] = self.offset2[mask]
-                    delta1 = delta1 / 100.0  # Offsets are in percent of pixel
-                    delta2 = delta2 / 100.0  # former arrays were integers
+                shape = numpy.broadcast(d1, d2).shape
+                if shape == self.offset1.shape:
+                    delta1 = self.offset1
+                    delta2 = self.offset2
+                elif shape[0] > self.offset1.shape[0]:  # probably working with corners
+                    delta1, delta2 = _corner_offsets(self.offset1, self.offset2, shape)
                 else:
-                    logger.warning("Surprizing situation !!! please investigate: offset has shape %s and input array have %s" % (self.offset1.shape, d1, shape))
+                    logger.warning("Surprizing situation !!! please investigate: offset has shape %s and input array have %s" % (self.offset1.shape, shape))
                     delta1 = delta2 = 0.
         # For pilatus,
-        p1 = (self._pixel1 * (delta1 + 0.5 + d1))
-        p2 = (self._pixel2 * (delta2 + 0.5 + d2))
+        shape = numpy.broadcast(d1, d2).shape
+        # Offsets are in percent of pixel
+        p1 = _pixel_positions(self._pixel1, delta1, d1, shape, dtype, out1, scale=0.01)
+        p2 = _pixel_positions(self._pixel2, delta2, d2, shape, dtype, out2, scale=0.01)
         return p1, p2
 
 
@@ -534,9 +803,6 @@ class Pilatus100k(Pilatus):
     Pilatus 100k detector
     """
     MAX_SHAPE = 195, 487
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus100k, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus200k(Pilatus):
@@ -544,9 +810,6 @@ class Pilatus200k(Pilatus):
     Pilatus 200k detector
     """
     MAX_SHAPE = (407, 487)
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus200k, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus300k(Pilatus):
@@ -554,9 +817,6 @@ class Pilatus300k(Pilatus):
     Pilatus 300k detector
     """
     MAX_SHAPE = (619, 487)
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus300k, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus300kw(Pilatus):
@@ -564,9 +824,6 @@ class Pilatus300kw(Pilatus):
     Pilatus 300k-wide detector
     """
     MAX_SHAPE = (195, 1475)
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus300kw, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus1M(Pilatus):
@@ -574,9 +831,6 @@ class Pilatus1M(Pilatus):
     Pilatus 1M detector
     """
     MAX_SHAPE = (1043, 981)
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus1M, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus2M(Pilatus):
@@ -585,9 +839,6 @@ class Pilatus2M(Pilatus):
     """
 
     MAX_SHAPE = 1679, 1475
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus2M, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Pilatus6M(Pilatus):
@@ -595,9 +846,6 @@ class Pilatus6M(Pilatus):
     Pilatus 6M detector
     """
     MAX_SHAPE = (2527, 2463)
-    def __init__(self, pixel1=172e-6, pixel2=172e-6):
-        super(Pilatus6M, self).__init__(pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 class Eiger(Detector):
     """
@@ -605,10 +853,14 @@ class Eiger(Detector):
     """
     MODULE_SIZE = (1065, 1030)
     MODULE_GAP = (37, 10)
+    MAX_SHAPE = (None, None)  # defined by each model
     force_pixel = True
 
     def __init__(self, pixel1=75e-6, pixel2=75e-6):
         Detector.__init__(self, pixel1=pixel1, pixel2=pixel2)
+        self.max_shape = self.MAX_SHAPE
+        # no distortion file is available for Eiger detectors (yet)
+        self.offset1 = self.offset2 = None
 
     def calc_mask(self):
         """
@@ -617,18 +869,10 @@ class Eiger(Detector):
         if (self.max_shape[0] or self.max_shape[1]) is None:
             raise NotImplementedError("Generic Pilatus detector does not know"
                                       "the max size ...")
-        mask = numpy.zeros(self.max_shape, dtype=numpy.int8)
-        # workinng in dim0 = Y
-        for i in range(self.MODULE_SIZE[0], self.max_shape[0],
-                       self.MODULE_SIZE[0] + self.MODULE_GAP[0]):
-            mask[i: i + self.MODULE_GAP[0], :] = 1
-        # workinng in dim1 = X
-        for i in range(self.MODULE_SIZE[1], self.max_shape[1],
-                       self.MODULE_SIZE[1] + self.MODULE_GAP[1]):
-            mask[:, i: i + self.MODULE_GAP[1]] = 1
-        return mask
+        return _gap_mask(self.max_shape, self.MODULE_SIZE, self.MODULE_GAP)
 
-    def calc_cartesian_positions(self, d1=None, d2=None):
+    @cache_full_grid
+    def calc_cartesian_positions(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
         """
         Calculate the position of each pixel center in cartesian coordinate
         and in meter of a couple of coordinates.
@@ -638,6 +882,8 @@ class Eiger(Detector):
         @type d1: ndarray (1D or 2D)
         @param d2: the X pixel positions (fast dimension)
         @type d2: ndarray (1D or 2D)
+        @param dtype: type of the result, double precision by default (numpy.float32 halves the size of the arrays)
+        @param out1, out2: arrays where to write the positions (reused from frame to frame), allocated if None
 
         @return: position in meter of the center of each pixels.
         @rtype: ndarray
@@ -645,11 +891,12 @@ class Eiger(Detector):
         d1 and d2 must have the same shape, returned array will have
         the same shape.
         """
+        # index grids are broadcast rather than allocated
         if (d1 is None):
-            d1 = numpy.outer(numpy.arange(self.max_shape[0]), numpy.ones(self.max_shape[1]))
+            d1 = numpy.arange(self.max_shape[0], dtype=numpy.float64)[:, numpy.newaxis]
 
         if (d2 is None):
-            d2 = numpy.outer(numpy.ones(self.max_shape[0]), numpy.arange(self.max_shape[1]))
+            d2 = numpy.arange(self.max_shape[1], dtype=numpy.float64)[numpy.newaxis, :]
 
         if self.offset1 is None or self.offset2 is None:
             delta1 = delta2 = 0.
@@ -657,35 +904,23 @@ class Eiger(Detector):
             if d2.ndim == 1:
                 d1n = d1.astype(numpy.int32)
                 d2n = d2.astype(numpy.int32)
-                delta1 = self.offset1[d1n, d2n] / 100.0  # Offsets are in percent of pixel
-                delta2 = self.offset2[d1n, d2n] / 100.0
+                delta1 = self.offset1[d1n, d2n]
+                delta2 = self.offset2[d1n, d2n]
             else:
-                if d1.shape == self.offset1.shape:
-                    delta1 = self.offset1 / 100.0  # Offsets are in percent of pixel
-                    delta2 = self.offset2 / 100.0
-                elif d1.shape[0] > self.offset1.shape[0]:  # probably working with corners
-                    s0, s1 = self.offset1.shape
-                    delta1 = numpy.zeros(d1.shape, dtype=numpy.int32)  # this is the natural type for pilatus CBF
-                    delta2 = numpy.zeros(d2.shape, dtype=numpy.int32)
-                    delta1[:s0, :s1] = self.offset1
-                    delta2[:s0, :s1] = self.offset2
-                    mask = numpy.where(delta1[-s0:, :s1] == 0)
-                    delta1[-s0:, :s1][mask] = self.offset1[mask]
-                    delta2[-s0:, :s1][mask] = self.offset2[mask]
-                    mask = numpy.where(delta1[-s0:, -s1:] == 0)
-                    delta1[-s0:, -s1:][mask] = self.offset1[mask]
-                    delta2[-s0:, -s1:][mask] = self.offset2[mask]
-                    mask = numpy.where(delta1[:s0, -s1:] == 0)
-                    delta1[:s0, -s1:][mask] = self.offset1[mask]
-                    delta2[:s0, -s1:][mask] = self.offset2[mask]
-                    delta1 = delta1 / 100.0  # Offsets are in percent of pixel
-                    delta2 = delta2 / 100.0  # former arrays were integers
+                shape = numpy.broadcast(d1, d2).shape
+                if shape == self.offset1.shape:
+                    delta1 = self.offset1
+                    delta2 = self.offset2
+                elif shape[0] > self.offset1.shape[0]:  # probably working with corners
+                    delta1, delta2 = _corner_offsets(self.offset1, self.offset2, shape)
                 else:
-                    logger.warning("Surprising situation !!! please investigate: offset has shape %s and input array have %s" % (self.offset1.shape, d1, shape))
+                    logger.warning("Surprising situation !!! please investigate: offset has shape %s and input array have %s" % (self.offset1.shape, shape))
                     delta1 = delta2 = 0.
         # For pilatus,
-        p1 = (self._pixel1 * (delta1 + 0.5 + d1))
-        p2 = (self._pixel2 * (delta2 + 0.5 + d2))
+        shape = numpy.broadcast(d1, d2).shape
+        # Offsets are in percent of pixel
+        p1 = _pixel_positions(self._pixel1, delta1, d1, shape, dtype, out1, scale=0.01)
+        p2 = _pixel_positions(self._pixel2, delta2, d2, shape, dtype, out2, scale=0.01)
         return p1, p2
 
 class Eiger1M(Eiger):
@@ -693,36 +928,24 @@ class Eiger1M(Eiger):
     Eiger 1M detector
     """
     MAX_SHAPE = (1065, 1030)
-    def __init__(self, pixel1=75e-6, pixel2=75e-6):
-        Eiger.__init__(self, pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 class Eiger4M(Eiger):
     """
     Eiger 4M detector
     """
     MAX_SHAPE = (2167, 2070)
-    def __init__(self, pixel1=75e-6, pixel2=75e-6):
-        Eiger.__init__(self, pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 class Eiger9M(Eiger):
     """
     Eiger 9M detector
     """
     MAX_SHAPE = (3269, 3110)
-    def __init__(self, pixel1=75e-6, pixel2=75e-6):
-        Eiger.__init__(self, pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 class Eiger16M(Eiger):
     """
     Eiger 16M detector
     """
     MAX_SHAPE = (4371, 4150)
-    def __init__(self, pixel1=75e-6, pixel2=75e-6):
-        Eiger.__init__(self, pixel1=pixel1, pixel2=pixel2)
-        self.max_shape = self.MAX_SHAPE
 
 
 class Fairchild(Detector):
@@ -782,15 +1005,22 @@ class FReLoN(Detector):
         All pixels which (center) turns to be out of the valid region are by default discarded
         """
 
-        d1 = numpy.outer(numpy.arange(self.max_shape[0]), numpy.ones(self.max_shape[1])) + 0.5
-        d2 = numpy.outer(numpy.ones(self.max_shape[0]), numpy.arange(self.max_shape[1])) + 0.5
-        dX = self.spline.splineFuncX(d2, d1)
-        dY = self.spline.splineFuncY(d2, d1)
-        p1 = dY + d1
-        p2 = dX + d2
-        below_min = numpy.logical_or((p2 < self.spline.xmin), (p1 < self.spline.ymin))
-        above_max = numpy.logical_or((p2 > self.spline.xmax), (p1 > self.spline.ymax))
-        mask = numpy.logical_or(below_min, above_max)
+        d1 = numpy.arange(self.max_shape[0]) + 0.5
+        d2 = numpy.arange(self.max_shape[1]) + 0.5
+        # positions are calculated in place of the displacements
+        p2 = self.spline.splineFuncX(d2, d1)
+        p2 += d2[numpy.newaxis, :]
+        p1 = self.spline.splineFuncY(d2, d1)
+        p1 += d1[:, numpy.newaxis]
+        # each test is accumulated in the mask through a single boolean buffer
+        mask = numpy.less(p2, self.spline.xmin)
+        tmp = numpy.empty_like(mask)
+        numpy.less(p1, self.spline.ymin, out=tmp)
+        mask |= tmp
+        numpy.greater(p2, self.spline.xmax, out=tmp)
+        mask |= tmp
+        numpy.greater(p1, self.spline.ymax, out=tmp)
+        mask |= tmp
         return mask
 
 
@@ -822,10 +1052,7 @@ class Mar345(Detector):
 #        self.mode = 1
 
     def calc_mask(self):
-        c = [i // 2 for i in self.max_shape]
-        x, y = numpy.ogrid[:self.max_shape[0], :self.max_shape[1]]
-        mask = ((x + 0.5 - c[0]) ** 2 + (y + 0.5 - c[1]) ** 2) > (c[0]) ** 2
-        return mask
+        return _circular_mask(self.max_shape).astype(numpy.int8)
 
 
 class Xpad_flat(Detector):
@@ -854,18 +1081,19 @@ class Xpad_flat(Detector):
         if (self.max_shape[0] or self.max_shape[1]) is None:
             raise NotImplementedError("Generic Xpad detector does not"
                                       " know the max size ...")
-        mask = numpy.zeros(self.max_shape, dtype=numpy.int8)
-        # workinng in dim0 = Y
-        for i in range(0, self.max_shape[0], self.MODULE_SIZE[0]):
-            mask[i, :] = 1
-            mask[i + self.MODULE_SIZE[0] - 1, :] = 1
-        # workinng in dim1 = X
-        for i in range(0, self.max_shape[1], self.MODULE_SIZE[1]):
-            mask[:, i ] = 1
-            mask[:, i + self.MODULE_SIZE[1] - 1] = 1
+        # workinng in dim1 = X: first and last column of each module are set
+        # in one row, which is broadcast to the whole mask in a single pass
+        row = numpy.zeros(self.max_shape[1], dtype=numpy.int8)
+        row[::self.MODULE_SIZE[1]] = 1
+        row[self.MODULE_SIZE[1] - 1::self.MODULE_SIZE[1]] = 1
+        mask = numpy.empty(self.max_shape, dtype=numpy.int8)
+        mask[...] = row
+        # workinng in dim0 = Y: first and last line of each module, as strided slices
+        mask[::self.MODULE_SIZE[0], :] = 1
+        mask[self.MODULE_SIZE[0] - 1::self.MODULE_SIZE[0], :] = 1
         return mask
 
-    def calc_cartesian_positions(self, d1=None, d2=None):
+    def calc_cartesian_positions(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
         """
         Calculate the position of each pixel center in cartesian coordinate
         and in meter of a couple of coordinates.
@@ -875,6 +1103,8 @@ class Xpad_flat(Detector):
         @type d1: ndarray (1D or 2D)
         @param d2: the X pixel positions (fast dimension)
         @type d2: ndarray (1D or 2D)
+        @param dtype: type of the result, double precision by default (numpy.float32 halves the size of the arrays)
+        @param out1, out2: arrays where to write the positions (reused from frame to frame), allocated if None
 
         @return: position in meter of the center of each pixels.
         @rtype: ndarray
@@ -883,45 +1113,45 @@ class Xpad_flat(Detector):
         the same shape.
 
         """
+        # index grids are broadcast rather than allocated
         if (d1 is None):
-            c1 = numpy.arange(self.max_shape[0])
-            for i in range(self.max_shape[0] // self.MODULE_SIZE[0]):
-                c1[i * self.MODULE_SIZE[0],
-                   (i + 1) * self.MODULE_SIZE[0]] += i * self.MODULE_GAP[0]
-        else:
-            c1 = d1 + (d1.astype(numpy.int64) // self.MODULE_SIZE[0])\
-                * self.MODULE_GAP[0]
+            d1 = numpy.arange(self.max_shape[0], dtype=numpy.float64)[:, numpy.newaxis]
         if (d2 is None):
-            c2 = numpy.arange(self.max_shape[1])
-            for i in range(self.max_shape[1] // self.MODULE_SIZE[1]):
-                c2[i * self.MODULE_SIZE[1],
-                   (i + 1) * self.MODULE_SIZE[1]] += i * self.MODULE_GAP[1]
-        else:
-            c2 = d2 + (d2.astype(numpy.int64) // self.MODULE_SIZE[1])\
-                * self.MODULE_GAP[1]
-
-        p1 = self.pixel1 * (0.5 + c1)
-        p2 = self.pixel2 * (0.5 + c2)
+            d2 = numpy.arange(self.max_shape[1], dtype=numpy.float64)[numpy.newaxis, :]
+        # each module is shifted by the gaps preceding it: int32 is plenty
+        # for the module index, the coordinates are summed in double precision
+        # whatever the type of d1 and d2
+        c1 = numpy.add(d1, (d1.astype(numpy.int32) // self.MODULE_SIZE[0]) * float(self.MODULE_GAP[0]),
+                       dtype=numpy.float64)
+        c2 = numpy.add(d2, (d2.astype(numpy.int32) // self.MODULE_SIZE[1]) * float(self.MODULE_GAP[1]),
+                       dtype=numpy.float64)
+
+        shape = numpy.broadcast(c1, c2).shape
+        p1 = _pixel_positions(self.pixel1, 0.0, c1, shape, dtype, out1)
+        p2 = _pixel_positions(self.pixel2, 0.0, c2, shape, dtype, out2)
         return p1, p2
 
 
-def _pixels_compute_center(pixels_size):
+def _pixels_compute_center(pixels_size, dtype=numpy.float64):
     """
     given a list of pixel size, this method return the center of each
     pixels. This method is generic.
 
     @param pixels_size: the size of the pixels.
     @type length: ndarray
+    @param dtype: type of the result, the sum is always done in double precision
 
     @return: the center-coordinates of each pixels 0..length
     @rtype: ndarray
     """
-    center = pixels_size.cumsum()
-    tmp = center.copy()
-    center[1:] += tmp[:-1]
-    center /= 2.
-
-    return center
+    # the center of pixel k is the sum of the k previous sizes plus half its own,
+    # computed in place as (2 * cumsum - size) / 2: scaling by 2 is exact and
+    # no temporary array is needed
+    center = numpy.cumsum(pixels_size, dtype=numpy.float64)
+    center *= 2.0
+    center -= pixels_size
+    center *= 0.5
+    return numpy.ascontiguousarray(center, dtype=dtype)
 
 
 def _pixels_extract_coordinates(coordinates, pixels):
@@ -981,12 +1211,13 @@ class ImXPadS140(Detector):
         @return: the coordinates of each pixels 0..length
         @rtype: ndarray
         """
-        size = numpy.ones(length)
+        size = numpy.empty(length)
+        size.fill(pixel_size)
         n = length // module_size
-        for i in range(1, n):
-            size[i * module_size - 1] = 2.5
-            size[i * module_size] = 2.5
-        return pixel_size * size
+        # last and first pixel of each pair of neighbouring modules are larger
+        size[module_size - 1:(n - 1) * module_size:module_size] = 2.5 * pixel_size
+        size[module_size:n * module_size:module_size] = 2.5 * pixel_size
+        return size
 
     def __init__(self, pixel1=130e-6, pixel2=130e-6):
         super(ImXPadS140, self).__init__(pixel1=pixel1, pixel2=pixel2)
@@ -998,7 +1229,7 @@ class ImXPadS140(Detector):
             (self.name, self.pixel1, self.pixel2)
 
 
-    def calc_cartesian_positions(self, d1=None, d2=None):
+    def calc_cartesian_positions(self, d1=None, d2=None, dtype=numpy.float64, out1=None, out2=None):
         """
         Calculate the position of each pixel center in cartesian coordinate
         and in meter of a couple of coordinates.
@@ -1008,6 +1239,8 @@ class ImXPadS140(Detector):
         @type d1: ndarray (1D or 2D)
         @param d2: the X pixel positions (fast dimension)
         @type d2: ndarray (1D or 2D)
+        @param dtype: type of the result, double precision by default (numpy.float32 halves the size of the arrays)
+        @param out1, out2: arrays where to write the positions (reused from frame to frame), allocated if None
 
         @return: position in meter of the center of each pixels.
         @rtype: ndarray
@@ -1016,9 +1249,16 @@ class ImXPadS140(Detector):
         the same shape.
 
         """
-        return tuple(_pixels_extract_coordinates(coordinates, pixels)
-                     for coordinates, pixels in zip(ImXPadS140.COORDINATES,
-                                                    (d1, d2)))
+        positions = []
+        for coordinates, pixels, out in zip(ImXPadS140.COORDINATES, (d1, d2), (out1, out2)):
+            ary = _pixels_extract_coordinates(coordinates, pixels)
+            if out is None:
+                ary = numpy.asarray(ary, dtype=dtype)
+            else:
+                out[...] = ary
+                ary = out
+            positions.append(ary)
+        return tuple(positions)
 
 
 class Perkin(Detector):
@@ -1034,11 +1274,32 @@ class Perkin(Detector):
 
 
 class Rayonix(Detector):
+    """
+    Generic Rayonix CCD detector: each model only declares its pixel size
+    for the official binning factors, its unbinned shape, the binning used
+    by default and whether the detector is circular.
+    """
     force_pixel = True
     BINNED_PIXEL_SIZE = {}
+    MAX_SHAPE = (None, None)
+    DEFAULT_BINNING = (1, 1)
+    CIRCULAR = False
 
     def __init__(self, pixel1=None, pixel2=None):
+        if (pixel1 is None) and (pixel2 is None) and self.BINNED_PIXEL_SIZE:
+            pixel1 = self.BINNED_PIXEL_SIZE[self.DEFAULT_BINNING[0]]
+            pixel2 = self.BINNED_PIXEL_SIZE[self.DEFAULT_BINNING[1]]
         Detector.__init__(self, pixel1=pixel1, pixel2=pixel2)
+        if self.MAX_SHAPE[0] is not None:
+            self._binning = tuple(self.DEFAULT_BINNING)
+            self.max_shape = (self.MAX_SHAPE[0] // self._binning[0],
+                              self.MAX_SHAPE[1] // self._binning[1])
+
+    def calc_mask(self):
+        """Circular mask for circular detectors, no mask otherwise"""
+        if self.CIRCULAR:
+            return _circular_mask(self.max_shape).astype(numpy.int8)
+        return Detector.calc_mask(self)
 
     def get_binning(self):
         return self._binning
@@ -1050,11 +1311,10 @@ class Rayonix(Detector):
         @param bin_size: set the binning of the detector
         @type bin_size: int or (int, int)
         """
-        if "__len__" in dir(bin_size) and len(bin_size) >= 2:
-            bin_size = int(round(float(bin_size[0]))), int(round(float(bin_size[1])))
-        else:
-            b = int(round(float(bin_size)))
-            bin_size = (b, b)
+        if (bin_size is self._binning) or \
+                (isinstance(bin_size, tuple) and bin_size == self._binning):
+            return  # unchanged, typically detector.binning = detector.binning
+        bin_size = _binning_factors(bin_size)
         if bin_size != self._binning:
             if (bin_size[0] in self.BINNED_PIXEL_SIZE) and (bin_size[1] in self.BINNED_PIXEL_SIZE):
                 self._pixel1 = self.BINNED_PIXEL_SIZE[bin_size[0]]
@@ -1066,6 +1326,15 @@ class Rayonix(Detector):
             self._binning = bin_size
             self.max_shape = (self.MAX_SHAPE[0] // bin_size[0],
                               self.MAX_SHAPE[1] // bin_size[1])
+            with self._sem:
+                # the mask is kept between calls: it is only recalculated
+                # (on next access) when it no longer fits the binned detector
+                mask = self._mask
+                if (mask is not False) and (mask is not None) and (mask.shape != self.max_shape):
+                    self._mask_crc = None
+                    self._mask = False
+                    # the mask file has to be read again by the next set_maskfile
+                    self._maskfile_key = None
     binning = property(get_binning, set_binning)
 
 
@@ -1079,7 +1348,6 @@ class Rayonix133(Rayonix):
 
     Circular detector
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1: 32e-6,
                          2: 64e-6,
                          4: 128e-6,
@@ -1087,18 +1355,8 @@ class Rayonix133(Rayonix):
                          }
     MAX_SHAPE = (4096 , 4096)
     aliases = ["MAR133"]
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=64e-6, pixel2=64e-6)
-        self.max_shape = (2048, 2048)
-        self._binning = (2, 2)
-
-    def calc_mask(self):
-        """Circular mask"""
-        c = [i // 2 for i in self.max_shape]
-        x, y = numpy.ogrid[:self.max_shape[0], :self.max_shape[1]]
-        mask = ((x + 0.5 - c[0]) ** 2 + (y + 0.5 - c[1]) ** 2) > (c[0]) ** 2
-        return mask
+    DEFAULT_BINNING = (2, 2)
+    CIRCULAR = True
 
 
 class RayonixSx165(Rayonix):
@@ -1115,19 +1373,7 @@ class RayonixSx165(Rayonix):
                          }
     MAX_SHAPE = (4096 , 4096)
     aliases = ["MAR165", "Rayonix Sx165"]
-    force_pixel = True
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=39.5e-6, pixel2=39.5e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
-    def calc_mask(self):
-        """Circular mask"""
-        c = [i // 2 for i in self.max_shape]
-        x, y = numpy.ogrid[:self.max_shape[0], :self.max_shape[1]]
-        mask = ((x + 0.5 - c[0]) ** 2 + (y + 0.5 - c[1]) ** 2) > (c[0]) ** 2
-        return mask
+    CIRCULAR = True
 
 
 class RayonixSx200(Rayonix):
@@ -1145,11 +1391,6 @@ class RayonixSx200(Rayonix):
     MAX_SHAPE = (4096 , 4096)
     aliases = ["Rayonix sx200"]
 
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=48e-6, pixel2=48e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
 
 class RayonixLx170(Rayonix):
     """
@@ -1167,14 +1408,8 @@ class RayonixLx170(Rayonix):
                          10:442.7083e-6
                          }
     MAX_SHAPE = (1920, 3840)
-    force_pixel = True
     aliases = ["Rayonix lx170"]
 
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=44.2708e-6, pixel2=44.2708e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
 
 class RayonixMx170(Rayonix):
     """
@@ -1194,11 +1429,6 @@ class RayonixMx170(Rayonix):
     MAX_SHAPE = (3840, 3840)
     aliases = ["Rayonix mx170"]
 
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=44.2708e-6, pixel2=44.2708e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
 
 class RayonixLx255(Rayonix):
     """
@@ -1218,11 +1448,6 @@ class RayonixLx255(Rayonix):
     MAX_SHAPE = (1920 , 5760)
     aliases = [ "Rayonix lx225"]
 
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=44.2708e-6, pixel2=44.2708e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
 
 class RayonixMx225(Rayonix):
     """
@@ -1231,7 +1456,6 @@ class RayonixMx225(Rayonix):
     Nota: this is the same definition for mx225he
     Personnal communication from M. Blum
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1:  36.621e-6,
                          2:  73.242e-6,
                          3: 109.971e-6,
@@ -1240,11 +1464,7 @@ class RayonixMx225(Rayonix):
                          }
     MAX_SHAPE = (6144, 6144)
     aliases = ["Rayonix mx225"]
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=73.242e-6, pixel2=73.242e-6)
-        self.max_shape = (3072, 3072)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 
 class RayonixMx225hs(Rayonix):
@@ -1253,7 +1473,6 @@ class RayonixMx225hs(Rayonix):
 
     Pixel size from a personnal communication from M. Blum
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1:  39.0625e-6,
                          2:  78.125e-6,
                          3: 117.1875e-6,
@@ -1265,10 +1484,7 @@ class RayonixMx225hs(Rayonix):
                          }
     MAX_SHAPE = (5760 , 5760)
     aliases = ["Rayonix mx225hs"]
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=78.125e-6, pixel2=78.125e-6)
-        self.max_shape = (2880, 2880)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 
 class RayonixMx300(Rayonix):
@@ -1277,7 +1493,6 @@ class RayonixMx300(Rayonix):
 
     Pixel size from a personnal communication from M. Blum
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1:  36.621e-6,
                          2:  73.242e-6,
                          3: 109.971e-6,
@@ -1286,11 +1501,7 @@ class RayonixMx300(Rayonix):
                          }
     MAX_SHAPE = (8192, 8192)
     aliases = ["Rayonix mx300"]
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=73.242e-6, pixel2=73.242e-6)
-        self.max_shape = (4096, 4096)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 
 class RayonixMx300hs(Rayonix):
@@ -1299,7 +1510,6 @@ class RayonixMx300hs(Rayonix):
 
     Pixel size from a personnal communication from M. Blum
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1:   39.0625e-6,
                          2:   78.125e-6,
                          3:  117.1875e-6,
@@ -1311,11 +1521,7 @@ class RayonixMx300hs(Rayonix):
                          }
     MAX_SHAPE = (7680, 7680)
     aliases = ["Rayonix mx300hs"]
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=78.125e-6, pixel2=78.125e-6)
-        self.max_shape = (3840, 3840)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 
 class RayonixMx340hs(Rayonix):
@@ -1324,7 +1530,6 @@ class RayonixMx340hs(Rayonix):
 
     Pixel size from a personnal communication from M. Blum
     """
-    force_pixel = True
     BINNED_PIXEL_SIZE = {1:   44.2708e-6,
                          2:   88.5417e-6,
                          3:  132.8125e-6,
@@ -1336,11 +1541,7 @@ class RayonixMx340hs(Rayonix):
                          }
     MAX_SHAPE = (7680 , 7680)
     aliases = ["Rayonix mx340hs"]
-
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=88.5417e-6, pixel2=88.5417e-6)
-        self.max_shape = (3840, 3840)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 class RayonixSx30hs(Rayonix):
     """
@@ -1360,11 +1561,6 @@ class RayonixSx30hs(Rayonix):
     MAX_SHAPE = (1920 , 1920)
     aliases = ["Rayonix Sx30hs"]
 
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=15.625e-6, pixel2=15.625e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
-
 
 class RayonixSx85hs(Rayonix):
     """
@@ -1383,10 +1579,7 @@ class RayonixSx85hs(Rayonix):
                          }
     MAX_SHAPE = (1920 , 1920)
     aliases = ["Rayonix Sx85hs"]
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=44.2708e-6, pixel2=44.2708e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
+
 
 class RayonixMx425hs(Rayonix):
     """
@@ -1405,10 +1598,6 @@ class RayonixMx425hs(Rayonix):
                          }
     MAX_SHAPE = (9600 , 9600)
     aliases = ["Rayonix mx425hs"]
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=44.2708e-6, pixel2=44.2708e-6)
-        self.max_shape = self.MAX_SHAPE
-        self._binning = (1, 1)
 
 
 class RayonixMx325(Rayonix):
@@ -1425,10 +1614,7 @@ class RayonixMx325(Rayonix):
                          }
     MAX_SHAPE = (8192 , 8192)
     aliases = ["Rayonix mx325"]
-    def __init__(self):
-        Rayonix.__init__(self, pixel1=79.346e-6, pixel2=79.346e-6)
-        self.max_shape = (4096, 4096)
-        self._binning = (2, 2)
+    DEFAULT_BINNING = (2, 2)
 
 
 
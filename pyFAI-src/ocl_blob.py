@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+#    Project: Azimuthal integration
+#             https://github.com/kif/pyFAI
+#
+#    File: "ocl_blob.py": OpenCL processing of the octaves of the blob detection
+#
+#    Copyright (C) European Synchrotron Radiation Facility, Grenoble, France
+#
+#    Principal author:       Jérôme Kieffer (Jerome.Kieffer@ESRF.eu)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Gaussian blurs, differences of gaussians and local maxima of one octave of
+the blob detection (see blob_detection.py), with the kernels of blob.cl
+"""
+
+__author__ = "Jérôme Kieffer"
+__license__ = "GPLv3"
+__date__ = "15/10/2026"
+__copyright__ = "2014, ESRF, Grenoble"
+__contact__ = "jerome.kieffer@esrf.fr"
+
+import os, gc, logging
+import threading
+import numpy
+from .opencl import ocl, pyopencl
+from .utils import get_cl_file
+if pyopencl:
+    mf = pyopencl.mem_flags
+else:
+    raise ImportError("pyopencl is not installed")
+logger = logging.getLogger("pyFAI.ocl_blob")
+
+
+def gaussian(sigma, width=None):
+    """
+    Return a Gaussian window of length "width" with standard-deviation "sigma".
+    Same as _convolution.gaussian
+
+    @param sigma: standard deviation sigma
+    @param width: length of the windows (int) By default 8*sigma+1, odd.
+    @return: normalized 1D float32 array
+    """
+    if width is None:
+        width = int(8 * sigma + 1)
+        if width % 2 == 0:
+            width += 1
+    sigma = float(sigma)
+    x = numpy.arange(width) - (width - 1) / 2.0
+    g = numpy.exp(-(x / sigma) ** 2 / 2.0)
+    return (g / g.sum()).astype(numpy.float32)
+
+
+class OCLBlob(object):
+    """
+    OpenCL implementation of the octave processing of the blob detection:
+    gaussian blurs, difference of gaussians and search for local maxima.
+
+    Images stay on the device during the whole octave, only the stack of
+    DoG, the maxima and the image used to seed the next octave are
+    transfered back.
+    """
+    def __init__(self, devicetype="all", platformid=None, deviceid=None, sigmas=None):
+        """
+        @param devicetype: can be "cpu","gpu","acc" or "all"
+        @param platformid: number of the platform as given by clinfo
+        @type platformid: int
+        @param deviceid: number of the device as given by clinfo
+        @type deviceid: int
+        @param sigmas: widths of the blurs of each octave, their filters are uploaded once
+        @type sigmas: list of float
+        """
+        self._sem = threading.Semaphore()
+        self._cl_mem = {}
+        self._filters = {}  # key: sigma, value: (buffer, size) of the gaussian filter
+        self._kernels = {}  # key: name, value: kernel, retrieved once from the program
+        self._shape = None
+        if (platformid is None) and (deviceid is None):
+            ids = ocl.select_device(devicetype)
+            if ids is None:
+                raise RuntimeError("No OpenCL device of type %s" % devicetype)
+            platformid, deviceid = ids
+        elif platformid is None:
+            platformid = 0
+        elif deviceid is None:
+            deviceid = 0
+        self.platform = ocl.platforms[platformid]
+        self.device = self.platform.devices[deviceid]
+        self.device_type = self.device.type
+        try:
+            self._ctx = pyopencl.Context(devices=[pyopencl.get_platforms()[platformid].get_devices()[deviceid]])
+            self._queue = pyopencl.CommandQueue(self._ctx)
+            self._compile_kernels()
+            for sigma in (sigmas or []):
+                self._get_filter(sigma)
+        except pyopencl.MemoryError as error:
+            raise MemoryError(error)
+
+    def __del__(self):
+        """
+        Destructor: release all buffers
+        """
+        self._free_buffers()
+        for cl_filter, size in self._filters.values():
+            cl_filter.release()
+        self._filters = {}
+        self._kernels = {}
+        self._program = None
+        self._queue = None
+        self._ctx = None
+        gc.collect()
+
+    def _allocate_buffers(self, shape, nscales):
+        """
+        Allocate OpenCL buffers for images of the given shape
+
+        @param shape: 2-tuple, shape of the images
+        @param nscales: number of difference of gaussians per octave
+        """
+        self._free_buffers()
+        size = shape[0] * shape[1]
+        size_of_float = numpy.dtype(numpy.float32).itemsize
+        ualloc = size * size_of_float * (3 + nscales) + size * (1 + nscales)
+        memory = self.device.memory
+        logger.info("%.3fMB are needed on device which has %.3fMB" % (ualloc / 1.0e6, memory / 1.0e6))
+        if ualloc >= memory:
+            raise MemoryError("Fatal error in _allocate_buffers. Not enough device memory for buffers (%lu requested, %lu available)" % (ualloc, memory))
+        try:
+            for name in ("previous", "blurred", "tmp"):
+                self._cl_mem[name] = pyopencl.Buffer(self._ctx, mf.READ_WRITE, size_of_float * size)
+            self._cl_mem["dogs"] = pyopencl.Buffer(self._ctx, mf.READ_WRITE, size_of_float * size * nscales)
+            self._cl_mem["mask"] = pyopencl.Buffer(self._ctx, mf.READ_ONLY, size)
+            self._cl_mem["is_max"] = pyopencl.Buffer(self._ctx, mf.WRITE_ONLY, size * nscales)
+        except pyopencl.MemoryError as error:
+            self._free_buffers()
+            raise MemoryError(error)
+        self._shape = (nscales,) + tuple(shape)
+
+    def _free_buffers(self):
+        """
+        free all memory allocated on the device
+        """
+        for buffer_name in self._cl_mem:
+            if self._cl_mem[buffer_name] is not None:
+                try:
+                    self._cl_mem[buffer_name].release()
+                    self._cl_mem[buffer_name] = None
+                except pyopencl.LogicError:
+                    logger.error("Error while freeing buffer %s" % buffer_name)
+        self._shape = None
+
+    def _compile_kernels(self, kernel_file=None):
+        """
+        Call the OpenCL compiler
+        @param kernel_file: path to the kernel file
+        """
+        kernel_name = "blob.cl"
+        if kernel_file is None:
+            if os.path.isfile(kernel_name):
+                kernel_file = os.path.abspath(kernel_name)
+            else:
+                kernel_file = get_cl_file(kernel_name)
+        else:
+            kernel_file = str(kernel_file)
+        with open(kernel_file, "r") as kernelFile:
+            kernel_src = kernelFile.read()
+        logger.info("Compiling file %s" % kernel_file)
+        try:
+            self._program = pyopencl.Program(self._ctx, kernel_src).build()
+        except pyopencl.MemoryError as error:
+            raise MemoryError(error)
+        for name in ("horizontal_convolution", "vertical_convolution",
+                     "difference_of_gaussians", "local_max"):
+            self._kernels[name] = pyopencl.Kernel(self._program, name)
+
+    def _get_filter(self, sigma):
+        """
+        Gaussian filter on the device, uploaded on first use of sigma
+
+        @param sigma: width of the gaussian
+        @return: buffer and number of coefficients
+        """
+        if sigma not in self._filters:
+            filter = gaussian(sigma)
+            cl_filter = pyopencl.Buffer(self._ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=filter)
+            self._filters[sigma] = (cl_filter, filter.size)
+        return self._filters[sigma]
+
+    def _blur(self, src, dst, sigma):
+        """
+        Separable gaussian blur of the image in buffer src into buffer dst
+
+        @param src, dst: name of the buffers
+        @param sigma: width of the gaussian
+        """
+        height, width = self._shape[1:]
+        cl_filter, size = self._get_filter(sigma)
+        args = (cl_filter, numpy.int32(size), numpy.int32(width), numpy.int32(height))
+        self._kernels["horizontal_convolution"](self._queue, (width, height), None,
+                                                self._cl_mem[src], self._cl_mem["tmp"], *args)
+        self._kernels["vertical_convolution"](self._queue, (width, height), None,
+                                              self._cl_mem["tmp"], self._cl_mem[dst], *args)
+
+    def _local_max(self, mask, n_5):
+        """
+        Flag the maxima of the stack of DoG in buffer "dogs" and retrieve them
+
+        @param mask: mask with invalid pixels (already on the device) or None
+        @param n_5: look for maxima in a 5x5 neighborhood
+        @return: array of int8 with 1 for the maxima
+        """
+        nscales, height, width = self._shape
+        self._kernels["local_max"](self._queue, (width, height, nscales), None,
+                                   self._cl_mem["dogs"], self._cl_mem["mask"], self._cl_mem["is_max"],
+                                   numpy.int32(mask is not None), numpy.int32(bool(n_5)),
+                                   numpy.int32(width), numpy.int32(height), numpy.int32(nscales))
+        is_max = numpy.empty(self._shape, dtype=numpy.int8)
+        pyopencl.enqueue_copy(self._queue, is_max, self._cl_mem["is_max"]).wait()
+        return is_max
+
+    def local_max(self, dogs, mask=None, n_5=False):
+        """
+        Search for local maxima in a stack of DoG, same as _blob.local_max
+
+        @param dogs: 3D array of difference of gaussian (scale, y, x)
+        @param mask: mask with invalid pixels
+        @param n_5: look for maxima in a 5x5 neighborhood
+        @return: 3D array of int8 with 1 for the maxima
+        """
+        shape = dogs.shape[1:]
+        nscales = dogs.shape[0]
+        with self._sem:
+            if self._shape != (nscales,) + tuple(shape):
+                self._allocate_buffers(shape, nscales)
+            pyopencl.enqueue_copy(self._queue, self._cl_mem["dogs"],
+                                  numpy.ascontiguousarray(dogs, dtype=numpy.float32))
+            if mask is not None:
+                pyopencl.enqueue_copy(self._queue, self._cl_mem["mask"],
+                                      numpy.ascontiguousarray(mask, dtype=numpy.int8))
+            return self._local_max(mask, n_5)
+
+    def octave(self, data, sigmas, mask=None, n_5=False, shrink_scale=None):
+        """
+        Process one octave of the pyramid of gaussians
+
+        @param data: current image
+        @param sigmas: list of pairs of absolute and relative sigma, as in BlobDetection
+        @param mask: mask with invalid pixels
+        @param n_5: look for maxima in a 5x5 neighborhood
+        @param shrink_scale: index of the blurred image to retrieve for the next octave
+        @return: stack of DoG, array flagging the maxima, blurred image number shrink_scale
+        """
+        shape = data.shape
+        nscales = len(sigmas) - 1
+        size = shape[0] * shape[1]
+        with self._sem:
+            if self._shape != (nscales,) + tuple(shape):
+                self._allocate_buffers(shape, nscales)
+            pyopencl.enqueue_copy(self._queue, self._cl_mem["previous"],
+                                  numpy.ascontiguousarray(data, dtype=numpy.float32))
+            if mask is not None:
+                pyopencl.enqueue_copy(self._queue, self._cl_mem["mask"],
+                                      numpy.ascontiguousarray(mask, dtype=numpy.int8))
+            shrink_src = data
+            idx = 0
+            for sigma_abs, sigma_rel in sigmas:
+                if sigma_rel != 0:
+                    self._blur("previous", "blurred", sigma_rel)
+                    self._kernels["difference_of_gaussians"](self._queue, (size,), None,
+                                                             self._cl_mem["previous"], self._cl_mem["blurred"],
+                                                             self._cl_mem["dogs"], numpy.int32(idx), numpy.int32(size))
+                    self._cl_mem["previous"], self._cl_mem["blurred"] = self._cl_mem["blurred"], self._cl_mem["previous"]
+                    idx += 1
+                    if idx == shrink_scale:
+                        shrink_src = numpy.empty(shape, dtype=numpy.float32)
+                        pyopencl.enqueue_copy(self._queue, shrink_src, self._cl_mem["previous"])
+            dogs = numpy.empty((nscales,) + tuple(shape), dtype=numpy.float32)
+            pyopencl.enqueue_copy(self._queue, dogs, self._cl_mem["dogs"])
+            is_max = self._local_max(mask, n_5)
+        return dogs, is_max, shrink_src
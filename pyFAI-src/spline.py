@@ -46,6 +46,47 @@ import traceback
 logger = logging.getLogger("pyFAI.spline")
 
 
+def basis_matrix(knots, order, x):
+    """
+    Values of all the B-splines defined on a knot vector at the given positions
+
+    Positions are clipped to the interval of definition, as fitpack.bisplev does.
+
+    @param knots: knot vector
+    @param order: order of the spline (3 for cubic)
+    @param x: 1D array of positions
+    @return: 2D array of shape (x.size, len(knots) - order - 1)
+    """
+    x = numpy.clip(numpy.asarray(x, dtype=numpy.float64), knots[order], knots[-order - 1])
+    nbasis = len(knots) - order - 1
+    basis = numpy.empty((x.size, nbasis), dtype=numpy.float64)
+    coeff = numpy.zeros(len(knots), dtype=numpy.float64)
+    for i in range(nbasis):
+        coeff[:] = 0.0
+        coeff[i] = 1.0
+        basis[:, i] = fitpack.splev(x, (knots, coeff, order))
+    return basis
+
+
+def grid_bisplev(x, y, tck):
+    """
+    Same as fitpack.bisplev(x, y, tck) for 1D arrays x and y, but the tensor
+    product is evaluated as a product of matrices R_x.C.R_y^T where R are the
+    B-splines sampled at the positions and C the coefficients, which is
+    handled by BLAS.
+
+    @param x, y: 1D arrays with the positions of the grid
+    @param tck: knotsX, knotsY, coefficients, orderX, orderY
+    @return: 2D array of shape (x.size, y.size)
+    """
+    knotsX, knotsY, coeff, orderX, orderY = tck
+    basisX = basis_matrix(knotsX, orderX, x)
+    basisY = basis_matrix(knotsY, orderY, y)
+    coeff = numpy.asarray(coeff)[:basisX.shape[1] * basisY.shape[1]]
+    coeff = coeff.reshape(basisX.shape[1], basisY.shape[1])
+    return basisX.dot(coeff).dot(basisY.T)
+
+
 class Spline(object):
     """
     This class is a python representation of the spline file
@@ -262,21 +303,19 @@ class Spline(object):
             x_1d_array = numpy.arange(self.xmin, self.xmax + 1)
             y_1d_array = numpy.arange(self.ymin, self.ymax + 1)
             startTime = time.time()
-            self.xDispArray = fitpack.bisplev(
+            self.xDispArray = grid_bisplev(
                 x_1d_array, y_1d_array, [self.xSplineKnotsX,
                                          self.xSplineKnotsY,
                                          self.xSplineCoeff,
                                          self.splineOrder,
-                                         self.splineOrder],
-                dx=0, dy=0).transpose()
+                                         self.splineOrder]).transpose()
             intermediateTime = time.time()
-            self.yDispArray = fitpack.bisplev(
+            self.yDispArray = grid_bisplev(
                 x_1d_array, y_1d_array, [self.ySplineKnotsX,
                                          self.ySplineKnotsY,
                                          self.ySplineCoeff,
                                          self.splineOrder,
-                                         self.splineOrder],
-                dx=0, dy=0).transpose()
+                                         self.splineOrder]).transpose()
             if timing:
                 logger.info("Timing for: X-Displacement spline evaluation: %.3f sec,"
                       " Y-Displacement Spline evaluation:  %.3f sec." %
@@ -304,13 +343,15 @@ class Spline(object):
                 x = x[:, 0]
                 y = y[0]
 
-        xDispArray = fitpack.bisplev(
-            x, y, [self.xSplineKnotsX,
-                   self.xSplineKnotsY,
-                   self.xSplineCoeff,
-                   self.splineOrder,
-                   self.splineOrder ],
-            dx=0, dy=0).transpose()
+        tck = [self.xSplineKnotsX,
+               self.xSplineKnotsY,
+               self.xSplineCoeff,
+               self.splineOrder,
+               self.splineOrder]
+        if numpy.ndim(x) == 1 and numpy.ndim(y) == 1:
+            xDispArray = grid_bisplev(x, y, tck).transpose()
+        else:
+            xDispArray = fitpack.bisplev(x, y, tck, dx=0, dy=0).transpose()
 
         return xDispArray
 
@@ -335,13 +376,15 @@ class Spline(object):
                 x = x[:, 0]
                 y = y[0]
 
-        yDispArray = fitpack.bisplev(
-            x, y, [self.ySplineKnotsX,
-                   self.ySplineKnotsY,
-                   self.ySplineCoeff,
-                   self.splineOrder,
-                   self.splineOrder ],
-            dx=0, dy=0).transpose()
+        tck = [self.ySplineKnotsX,
+               self.ySplineKnotsY,
+               self.ySplineCoeff,
+               self.splineOrder,
+               self.splineOrder]
+        if numpy.ndim(x) == 1 and numpy.ndim(y) == 1:
+            yDispArray = grid_bisplev(x, y, tck).transpose()
+        else:
+            yDispArray = fitpack.bisplev(x, y, tck, dx=0, dy=0).transpose()
 
         return yDispArray
 
@@ -223,8 +223,8 @@ _convolution_dic = dict(name="_convolution",
 _blob_dic = dict(name="_blob",
                     include_dirs=get_numpy_include_dirs(),
                     sources=[src['_blob']],
-#                    extra_compile_args=["openmp"],
-#                    extra_link_args=["openmp"]
+                    extra_compile_args=["openmp"],
+                    extra_link_args=["openmp"]
                     )
 
 morphology_dic = dict(name="morphology",
@@ -6,69 +6,130 @@ import numpy
 cimport numpy
 from cython.parallel import prange
 
+# The comparisons are written out for the two neighbourhoods (3x3 and 5x5
+# without corners): constant offsets and no test on n_5 in the inner loop.
+# The row kernels return an int (always 0) rather than void: this way the
+# calls from prange need no exception check holding the GIL with Cython 3,
+# and the code still builds with older Cython which lack "noexcept".
+
+cdef inline bint _greater_3x3(float c, float *m1, float *z0, float *p1, int x) nogil:
+    "c is strictly greater than the 3x3 block centered on x (rows y-1, y, y+1)"
+    return ((c > m1[x - 1]) & (c > m1[x]) & (c > m1[x + 1]) &
+            (c > z0[x - 1]) & (c > z0[x]) & (c > z0[x + 1]) &
+            (c > p1[x - 1]) & (c > p1[x]) & (c > p1[x + 1]))
+
+
+cdef inline bint _greater_ring_3(float c, float *m1, float *z0, float *p1, int x) nogil:
+    "c is strictly greater than the 8 neighbours of x in its own plane"
+    return ((c > m1[x - 1]) & (c > m1[x]) & (c > m1[x + 1]) &
+            (c > z0[x - 1]) & (c > z0[x + 1]) &
+            (c > p1[x - 1]) & (c > p1[x]) & (c > p1[x + 1]))
+
+
+cdef inline bint _greater_ring_5(float c, float *m2, float *m1, float *z0, float *p1, float *p2, int x) nogil:
+    "c is strictly greater than the outer ring of the 5x5 block, corners excluded"
+    return ((c > m2[x - 1]) & (c > m2[x]) & (c > m2[x + 1]) &
+            (c > m1[x - 2]) & (c > m1[x + 2]) &
+            (c > z0[x - 2]) & (c > z0[x + 2]) &
+            (c > p1[x - 2]) & (c > p1[x + 2]) &
+            (c > p2[x - 1]) & (c > p2[x]) & (c > p2[x + 1]))
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def local_max(float[:,:,:] dogs, mask=None, bint n_5=False):
+cdef int _local_max_3(float[:,:,::1] dogs, numpy.int8_t[:,::1] mask, numpy.int8_t[:,:,::1] is_max,
+                      int s, int y) nogil:
+    "Process row y of scale s in the 3x3x3 neighbourhood, returns 0"
+    cdef int x, nx = dogs.shape[2]
+    cdef float c
+    cdef float *a1 = &dogs[s - 1, y - 1, 0]
+    cdef float *a0 = &dogs[s - 1, y, 0]
+    cdef float *a2 = &dogs[s - 1, y + 1, 0]
+    cdef float *b1 = &dogs[s, y - 1, 0]
+    cdef float *b0 = &dogs[s, y, 0]
+    cdef float *b2 = &dogs[s, y + 1, 0]
+    cdef float *c1 = &dogs[s + 1, y - 1, 0]
+    cdef float *c0 = &dogs[s + 1, y, 0]
+    cdef float *c2 = &dogs[s + 1, y + 1, 0]
+    for x in range(1, nx - 1):
+        c = b0[x]
+        is_max[s, y, x] = ((mask[y, x] == 0) &
+                           _greater_3x3(c, a1, a0, a2, x) &
+                           _greater_ring_3(c, b1, b0, b2, x) &
+                           _greater_3x3(c, c1, c0, c2, x))
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _local_max_5(float[:,:,::1] dogs, numpy.int8_t[:,::1] mask, numpy.int8_t[:,:,::1] is_max,
+                      int s, int y) nogil:
+    "Process row y of scale s in the 3x5x5 neighbourhood (corners excluded), returns 0"
+    cdef int x, nx = dogs.shape[2]
+    cdef float c
+    cdef float *a3 = &dogs[s - 1, y - 2, 0]
+    cdef float *a1 = &dogs[s - 1, y - 1, 0]
+    cdef float *a0 = &dogs[s - 1, y, 0]
+    cdef float *a2 = &dogs[s - 1, y + 1, 0]
+    cdef float *a4 = &dogs[s - 1, y + 2, 0]
+    cdef float *b3 = &dogs[s, y - 2, 0]
+    cdef float *b1 = &dogs[s, y - 1, 0]
+    cdef float *b0 = &dogs[s, y, 0]
+    cdef float *b2 = &dogs[s, y + 1, 0]
+    cdef float *b4 = &dogs[s, y + 2, 0]
+    cdef float *c3 = &dogs[s + 1, y - 2, 0]
+    cdef float *c1 = &dogs[s + 1, y - 1, 0]
+    cdef float *c0 = &dogs[s + 1, y, 0]
+    cdef float *c2 = &dogs[s + 1, y + 1, 0]
+    cdef float *c4 = &dogs[s + 1, y + 2, 0]
+    for x in range(2, nx - 2):
+        c = b0[x]
+        is_max[s, y, x] = ((mask[y, x] == 0) &
+                           _greater_3x3(c, a1, a0, a2, x) &
+                           _greater_ring_3(c, b1, b0, b2, x) &
+                           _greater_3x3(c, c1, c0, c2, x) &
+                           _greater_ring_5(c, a3, a1, a0, a2, a4, x) &
+                           _greater_ring_5(c, b3, b1, b0, b2, b4, x) &
+                           _greater_ring_5(c, c3, c1, c0, c2, c4, x))
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def local_max(dogs, mask=None, bint n_5=False):
     """
     Calculate if a point is a maximum in a 3D space: (scale, y, x)
-    
+
+    One specialized kernel per neighbourhood processes a row at once in a
+    branch-less loop over x so that the C compiler can vectorize it.
+
     @param dogs: 3D array of difference of gaussian
     @param mask: mask with invalid pixels
     @param N-5: take a neighborhood of 5x5 pixel in plane
     @return: 3d_array with 1 where is_max 
     """
-    cdef bint do_mask = mask is not None
-    cdef int ns, ny, nx, s, x, y
-    cdef numpy.int8_t m 
-    cdef float c 
-    cdef numpy.int8_t[:,:] cmask
-    ns = dogs.shape[0]
-    ny = dogs.shape[1]
-    nx = dogs.shape[2]
-    if do_mask:
+    cdef int ns, ny, nx, s, y, border
+    cdef float[:,:,::1] cdogs = numpy.ascontiguousarray(dogs, dtype=numpy.float32)
+    cdef numpy.int8_t[:,::1] cmask
+    border = 2 if n_5 else 1
+    ns = cdogs.shape[0]
+    ny = cdogs.shape[1]
+    nx = cdogs.shape[2]
+    if mask is not None:
         assert mask.shape[0] == ny
         assert mask.shape[1] == nx
         cmask = numpy.ascontiguousarray(mask, dtype=numpy.int8)
+    else:
+        cmask = numpy.zeros((ny, nx), dtype=numpy.int8)
 
-    cdef numpy.ndarray[numpy.int8_t, ndim=3] is_max = numpy.zeros((ns,ny,nx), dtype=numpy.int8)
-    if ns<3 or ny<3 or nx<3:
-        return mask
+    cdef numpy.int8_t[:,:,::1] is_max = numpy.zeros((ns,ny,nx), dtype=numpy.int8)
+    if ns<3 or ny<=2*border or nx<=2*border:
+        return numpy.asarray(is_max)
     for s in range(1,ns-1):
-        for y in range(1,ny-1):
-            for x in range(1,nx-1):
-                c =  dogs[s,y,x]
-                if do_mask and cmask[y,x]:
-                    m = 0
-                else:
-                    m = (c>dogs[s,y,x-1]) and (c>dogs[s,y,x+1]) and\
-                        (c>dogs[s,y-1,x]) and (c>dogs[s,y+1,x]) and\
-                        (c>dogs[s,y-1,x-1]) and (c>dogs[s,y-1,x+1]) and\
-                        (c>dogs[s,y+1,x-1]) and (c>dogs[s,y+1,x+1]) and\
-                        (c>dogs[s-1,y,x]) and (c>dogs[s+1,y,x]) and\
-                        (c>dogs[s-1,y,x-1]) and (c>dogs[s-1,y,x+1]) and\
-                        (c>dogs[s-1,y-1,x]) and (c>dogs[s-1,y+1,x]) and\
-                        (c>dogs[s-1,y-1,x-1]) and (c>dogs[s-1,y-1,x+1]) and\
-                        (c>dogs[s-1,y+1,x-1]) and (c>dogs[s-1,y+1,x+1]) and\
-                        (c>dogs[s+1,y,x-1]) and (c>dogs[s+1,y,x+1]) and\
-                        (c>dogs[s+1,y-1,x]) and (c>dogs[s+1,y+1,x]) and\
-                        (c>dogs[s+1,y-1,x-1]) and (c>dogs[s+1,y-1,x+1]) and\
-                        (c>dogs[s+1,y+1,x-1]) and (c>dogs[s+1,y+1,x+1])
-                    if n_5:
-                        if x>1:
-                            m = m and (c>dogs[s,y,x-2]) and (c>dogs[s,y-1,x-2]) and (c>dogs[s,y+1,x-2])\
-                                  and (c>dogs[s-1,y,x-2]) and (c>dogs[s-1,y-1,x-2]) and (c>dogs[s-1,y+1,x-2])\
-                                  and (c>dogs[s+1,y,x-2]) and (c>dogs[s+1,y-1,x-2]) and (c>dogs[s+1,y+1,x-2])
-                        if x<nx-2:
-                            m = m and (c>dogs[s,y,x+2]) and (c>dogs[s,y-1,x+2]) and (c>dogs[s,y+1,x+2])\
-                                  and (c>dogs[s-1,y,x+2]) and (c>dogs[s-1,y-1,x+2]) and (c>dogs[s-1,y+1,x+2])\
-                                  and (c>dogs[s+1,y,x+2]) and (c>dogs[s+1,y-1,x+2]) and (c>dogs[s+1,y+1,x+2])
-                        if y>1:
-                            m = m and (c>dogs[s,y-2,x]) and (c>dogs[s,y-2,x-1]) and (c>dogs[s,y-2,x+1])\
-                                  and (c>dogs[s-1,y-2,x]) and (c>dogs[s-1,y-2,x-1]) and (c>dogs[s-1,y-2,x+1])\
-                                  and (c>dogs[s+1,y-2,x]) and (c>dogs[s+1,y-2,x-1]) and (c>dogs[s+1,y+2,x+1])
-                        if y<ny-2:
-                            m = m and (c>dogs[s,y+2,x]) and (c>dogs[s,y+2,x-1]) and (c>dogs[s,y+2,x+1])\
-                                  and (c>dogs[s-1,y+2,x]) and (c>dogs[s-1,y+2,x-1]) and (c>dogs[s-1,y+2,x+1])\
-                                  and (c>dogs[s+1,y+2,x]) and (c>dogs[s+1,y+2,x-1]) and (c>dogs[s+1,y+2,x+1])
-                is_max[s,y,x] = m
-    return is_max 
+        if n_5:
+            for y in prange(border, ny-border, nogil=True, schedule="static"):
+                _local_max_5(cdogs, cmask, is_max, s, y)
+        else:
+            for y in prange(border, ny-border, nogil=True, schedule="static"):
+                _local_max_3(cdogs, cmask, is_max, s, y)
+    return numpy.asarray(is_max)
@@ -87,10 +87,28 @@ uint32_t slowcrc(char *str, uint32_t len) {
 }
 
 uint32_t fastcrc(const char *str, uint32_t len) {
-	uint32_t q=len/sizeof(uint32_t),
-		     r=len%sizeof(uint32_t),
-		     *p=(uint32_t*)str,
-		     crc=0;
+	uint32_t q, r, *p, crc=0;
+
+#if defined(__x86_64__)
+	/* 8 bytes per instruction: same result as 2 crc32l (little endian) */
+	uint64_t crc64=0, *p64=(uint64_t*)str;
+	q=len/sizeof(uint64_t);
+	while (q--) {
+//		crc64 = _mm_crc32_u64(crc64,*p64);
+		__asm__ __volatile__(
+				".byte 0xf2, 0x48, 0xf, 0x38, 0xf1, 0xf1;"
+				:"=S"(crc64)
+				:"0"(crc64), "c"(*p64)
+				);
+		p64++;
+	}
+	crc=(uint32_t)crc64;
+	str=(char*)p64;
+	len=len%sizeof(uint64_t);
+#endif
+	q=len/sizeof(uint32_t);
+	r=len%sizeof(uint32_t);
+	p=(uint32_t*)str;
 
 	while (q--) {
 //		crc = _mm_crc32_u32(crc,*p);
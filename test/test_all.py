@@ -56,6 +56,7 @@ from test_utils                import test_suite_all_Utils
 from test_polarization         import test_suite_all_Polarization
 from test_detector             import test_suite_all_detectors
 from test_convolution          import test_suite_all_convolution
+from test_blob_detection       import test_suite_all_blob_detection
 from test_sparse               import test_suite_all_sparse
 from test_csr                  import test_suite_all_OpenCL_CSR
 
@@ -77,6 +78,7 @@ def test_suite_all():
     testSuite.addTest(test_suite_all_Utils())
     testSuite.addTest(test_suite_all_detectors())
     testSuite.addTest(test_suite_all_convolution())
+    testSuite.addTest(test_suite_all_blob_detection())
     testSuite.addTest(test_suite_all_sparse())
     testSuite.addTest(test_suite_all_OpenCL_CSR())
     return testSuite
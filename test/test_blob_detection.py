@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#    Project: Azimuthal integration
+#             https://github.com/kif/pyFAI
+#
+#    Copyright (C) European Synchrotron Radiation Facility, Grenoble, France
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"test suite for the blob detection"
+
+__author__ = "Jérôme Kieffer"
+__contact__ = "Jerome.Kieffer@ESRF.eu"
+__license__ = "GPLv3+"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+__date__ = "15/10/2026"
+
+import sys
+import unittest
+import numpy
+from utilstest import getLogger  # UtilsTest, Rwp, getLogger
+logger = getLogger(__file__)
+pyFAI = sys.modules["pyFAI"]
+from pyFAI import _blob, _convolution
+from pyFAI.blob_detection import BlobDetection, KeyPointList, local_max
+try:
+    from pyFAI.ocl_blob import OCLBlob
+except ImportError as error:
+    logger.warning("OpenCL module (pyopencl) is not present, skip tests. %s." % error)
+    OCLBlob = None
+
+
+def make_dogs(shape=(5, 64, 80), levels=32):
+    """
+    Stack of DoG with few distinct values: many neighbours are equal, which
+    checks the strict comparisons, and a mask with a few blocks of invalid pixels
+    """
+    numpy.random.seed(0)
+    dogs = numpy.random.randint(0, levels, shape).astype(numpy.float32)
+    mask = numpy.zeros(shape[1:], dtype=numpy.int8)
+    mask[10:15, 20:30] = 1
+    mask[40:, 60:] = 1
+    return dogs, mask
+
+
+class TestLocalMax(unittest.TestCase):
+    def test_cython_python(self):
+        """
+        Cython and python implementations find the same maxima, with and
+        without mask, whatever the tiling of the python version
+        """
+        dogs, mask = make_dogs()
+        for n_5 in (False, True):
+            for msk in (None, mask):
+                ref = _blob.local_max(dogs, msk, n_5)
+                self.assertTrue(ref.any(), "some maxima are found")
+                for tile in (256, 16):
+                    obt = local_max(dogs, msk, n_5, tile=tile)
+                    self.assertEqual(abs(ref.astype(int) - obt).max(), 0,
+                                     "same maxima with n_5=%s, mask=%s, tile=%s" % (n_5, msk is not None, tile))
+                if msk is not None:
+                    self.assertEqual(ref[:, mask != 0].max(), 0, "no maxima on masked pixels")
+
+
+class TestKeyPointList(unittest.TestCase):
+    def test_extend(self):
+        """
+        The capacity is doubled when exceeded, the keypoints are kept in order
+        """
+        kp = KeyPointList()
+        self.assertEqual(len(kp), 0)
+        kp.extend(*[numpy.arange(3) + 10 * i for i in range(4)])
+        self.assertEqual(len(kp), 3)
+        self.assertEqual(kp._data.shape[1], 3)
+        kp.extend(*[numpy.arange(3, 5) + 10 * i for i in range(4)])
+        self.assertEqual(len(kp), 5)
+        self.assertEqual(kp._data.shape[1], 6, "capacity is doubled")
+        kp.extend(*[numpy.array([5]) + 10 * i for i in range(4)])
+        self.assertEqual(len(kp), 6)
+        self.assertEqual(kp._data.shape[1], 6, "no reallocation within capacity")
+        kp.extend(*[numpy.arange(6, 20) + 10 * i for i in range(4)])
+        self.assertEqual(len(kp), 20)
+        self.assertEqual(kp._data.shape[1], 20, "grown to the needed size when more than doubled")
+        for i, field in enumerate((kp.x, kp.y, kp.scale, kp.I)):
+            self.assertEqual(field.dtype, numpy.float32)
+            self.assertEqual(abs(field - (numpy.arange(20) + 10 * i)).max(), 0)
+        kp.extend(*[numpy.array([]) for i in range(4)])
+        self.assertEqual(len(kp), 20)
+
+    def test_trim(self):
+        """
+        trim releases the unused capacity and keeps the keypoints
+        """
+        kp = KeyPointList()
+        kp.extend(*[numpy.arange(4) + i for i in range(4)])
+        kp.extend(*[numpy.arange(4, 5) + i for i in range(4)])
+        self.assertEqual(kp._data.shape[1], 8)
+        kp.trim()
+        self.assertEqual(kp._data.shape[1], 5)
+        self.assertEqual(len(kp), 5)
+        self.assertEqual(abs(kp.y - numpy.arange(1, 6)).max(), 0)
+        # still growable
+        kp.extend(*[numpy.arange(5, 6) + i for i in range(4)])
+        self.assertEqual(len(kp), 6)
+        self.assertEqual(abs(kp.I - numpy.arange(3, 9)).max(), 0)
+
+
+class TestBlobDetection(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(2)
+        self.img = numpy.random.random((64, 80)).astype(numpy.float32) + 1.0
+        self.mask = numpy.zeros(self.img.shape, dtype=numpy.int8)
+        self.mask[20:30, 10:50] = 1
+
+    def test_mask(self):
+        """
+        The mask is applied to the processed data, not to the image
+        """
+        bd = BlobDetection(self.img, mask=self.mask)
+        raw = bd.raw.copy()
+        self.assertEqual(abs(raw - numpy.log(self.img)).max(), 0, "raw is the log of the image")
+        bd._one_octave(shrink=True, do_SG4=False)
+        self.assertEqual(abs(bd.raw - raw).max(), 0, "raw is not modified by the processing")
+        bd.set_mask(numpy.zeros(self.img.shape))
+        self.assertEqual(abs(bd.raw - raw).max(), 0, "raw is not modified by set_mask")
+        self.assertEqual(bd.mask[1:-1, 1:-1].max(), 0, "previous mask is forgotten")
+        self.assertEqual(bd.mask[0].min(), 1, "border is masked")
+
+    def test_dilated_mask(self):
+        """
+        The dilation of a mask is reused by the detections on the next images,
+        even when another mask was used in between
+        """
+        other = numpy.zeros(self.img.shape, dtype=numpy.int8)
+        other[40:50, 60:70] = 1
+        bd1 = BlobDetection(self.img, mask=self.mask)
+        bd2 = BlobDetection(self.img, mask=other)
+        bd3 = BlobDetection(self.img * 2, mask=self.mask.copy())
+        self.assertTrue(bd1.cur_mask is bd3.cur_mask, "same mask: dilation is reused")
+        self.assertFalse(bd1.cur_mask is bd2.cur_mask, "different masks")
+        self.assertTrue(bd2.cur_mask[45, 65] and not bd2.cur_mask[25, 30], "dilation of the other mask")
+
+
+class TestOclBlob(unittest.TestCase):
+    def setUp(self):
+        if OCLBlob is None:
+            self.ocl = None
+            return
+        try:
+            self.ocl = OCLBlob()
+        except (RuntimeError, MemoryError) as error:
+            logger.warning("No OpenCL device available: %s" % error)
+            self.ocl = None
+
+    def tearDown(self):
+        self.ocl = None
+
+    def test_local_max(self):
+        """
+        OpenCL and Cython find the same maxima, with and without mask
+        """
+        if self.ocl is None:
+            return
+        dogs, mask = make_dogs()
+        for n_5 in (False, True):
+            for msk in (None, mask):
+                ref = _blob.local_max(dogs, msk, n_5)
+                obt = self.ocl.local_max(dogs, msk, n_5)
+                self.assertTrue(ref.any(), "some maxima are found")
+                self.assertEqual(abs(ref.astype(int) - obt).max(), 0,
+                                 "same maxima with n_5=%s, mask=%s" % (n_5, msk is not None))
+
+    def test_octave(self):
+        """
+        The blurs and DoG of an octave processed by OpenCL are the ones of
+        the Cython convolution, its maxima are the ones of its stack of DoG
+        """
+        if self.ocl is None:
+            return
+        numpy.random.seed(1)
+        data = numpy.random.random((64, 80)).astype(numpy.float32)
+        sigmas = [(0.5, 0), (0.707, 0.5), (1.0, 0.707), (1.414, 1.0), (2.0, 1.414)]
+        mask = make_dogs()[1]
+        blurs = [data]
+        for sigma_abs, sigma_rel in sigmas[1:]:
+            blurs.append(_convolution.gaussian_filter(blurs[-1], sigma_rel))
+        dogs_ref = numpy.array([blurs[i] - blurs[i + 1] for i in range(len(sigmas) - 1)])
+        for n_5 in (False, True):
+            dogs, is_max, shrink_src = self.ocl.octave(data, sigmas, mask, n_5, 2)
+            self.assertEqual(dogs.shape, (4, 64, 80))
+            self.assertEqual(shrink_src.shape, data.shape)
+            self.assertTrue(numpy.allclose(dogs, dogs_ref, rtol=0, atol=1e-5), "same DoG as the Cython blurs")
+            self.assertTrue(numpy.allclose(shrink_src, blurs[2], rtol=0, atol=1e-5), "same blurred image")
+            ref = _blob.local_max(dogs, mask, n_5)
+            self.assertEqual(abs(ref.astype(int) - is_max).max(), 0, "same maxima with n_5=%s" % n_5)
+
+
+def test_suite_all_blob_detection():
+    testSuite = unittest.TestSuite()
+    testSuite.addTest(TestLocalMax("test_cython_python"))
+    testSuite.addTest(TestKeyPointList("test_extend"))
+    testSuite.addTest(TestKeyPointList("test_trim"))
+    testSuite.addTest(TestBlobDetection("test_mask"))
+    testSuite.addTest(TestBlobDetection("test_dilated_mask"))
+    if OCLBlob is None:
+        logger.warning("OpenCL module (pyopencl) is not present, skip tests")
+    else:
+        testSuite.addTest(TestOclBlob("test_local_max"))
+        testSuite.addTest(TestOclBlob("test_octave"))
+    return testSuite
+
+if __name__ == '__main__':
+    mysuite = test_suite_all_blob_detection()
+    runner = unittest.TextTestRunner()
+    runner.run(mysuite)
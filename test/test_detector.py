@@ -31,16 +31,24 @@ __license__ = "GPLv3+"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 __date__ = "24/09/2013"
 
+import os
 import sys
+import tempfile
 import unittest
 import numpy
 from utilstest import getLogger  # UtilsTest, Rwp, getLogger
 logger = getLogger(__file__)
 pyFAI = sys.modules["pyFAI"]
 from pyFAI.detectors import detector_factory, ALL_DETECTORS
+from pyFAI import detectors
+try:
+    import fabio
+except ImportError:
+    fabio = None
 
 
 class TestDetector(unittest.TestCase):
+    tmp_dir = os.environ.get("PYFAI_TEMPDIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp"))
 
     def test_detector_instanciate(self):
         """
@@ -49,6 +57,23 @@ class TestDetector(unittest.TestCase):
         for k, v in ALL_DETECTORS.iteritems():
             v()
 
+    def test_detector_factory_names(self):
+        """
+        The factory accepts the names of the classes and their aliases,
+        whatever the case, spaces or underscores
+        """
+        names = {detectors.Pilatus1M: ["Pilatus1M", "pilatus1m", "PILATUS1M", " pilatus1m ",
+                                       "Pilatus 1M", "pilatus_1m"],
+                 detectors.RayonixSx165: ["RayonixSx165", "rayonixsx165", "MAR165", "mar165",
+                                          "Rayonix Sx165", "rayonix sx165", "rayonix_sx165"],
+                 detectors.ImXPadS140: ["ImXPadS140", "Imxpad S140", "imxpad_s140", "imxpads140"],
+                 detectors.Mar345: ["Mar345", "MAR 345", "mar_345", "mar3450"],
+                 detectors.Xpad_flat: ["Xpad_flat", "xpad_flat", "Xpad flat", " XPAD_FLAT"]}
+        for klass, spellings in names.items():
+            for name in spellings:
+                self.assertEqual(type(detector_factory(name)), klass, "%s is a %s" % (name, klass.__name__))
+        self.assertRaises(RuntimeError, detector_factory, "pilatus 3m")
+
     def test_detector_imxpad_s140(self):
         """
         The masked image has a masked ring around 1.5deg with value
@@ -77,6 +102,139 @@ class TestDetector(unittest.TestCase):
         self.assertAlmostEqual(x[1], x[0] + 130e-6)
         self.assertAlmostEqual(x[79], x[78] + 130e-6 * 3.5 / 2.)
 
+    def test_detector_positions_dtype(self):
+        """
+        positions are in double precision unless requested otherwise
+        and can be written in arrays provided by the caller
+        """
+        d1, d2 = numpy.mgrid[100:110, 75:90]
+        for name in ("pilatus1m", "xpad_flat", "imxpad_s140"):
+            det = detector_factory(name)
+            for args in ((), (d1, d2)):
+                p1, p2 = det.calc_cartesian_positions(*args)
+                self.assertEqual(p1.dtype, numpy.float64, "%s: float64 by default" % name)
+                self.assertEqual(p2.dtype, numpy.float64, "%s: float64 by default" % name)
+
+                s1, s2 = det.calc_cartesian_positions(*args, dtype=numpy.float32)
+                self.assertEqual(s1.dtype, numpy.float32, "%s: float32 on request" % name)
+                self.assertEqual(s2.dtype, numpy.float32, "%s: float32 on request" % name)
+                self.assertTrue(numpy.allclose(s1, p1, rtol=1e-6, atol=0), "%s: same positions in float32" % name)
+                self.assertTrue(numpy.allclose(s2, p2, rtol=1e-6, atol=0), "%s: same positions in float32" % name)
+
+                out1 = numpy.empty(p1.shape, dtype=numpy.float64)
+                out2 = numpy.empty(p2.shape, dtype=numpy.float64)
+                o1, o2 = det.calc_cartesian_positions(*args, out1=out1, out2=out2)
+                self.assertTrue(o1 is out1, "%s: out1 is filled" % name)
+                self.assertTrue(o2 is out2, "%s: out2 is filled" % name)
+                self.assertEqual(abs(out1 - p1).max(), 0, "%s: out1 is correct" % name)
+                self.assertEqual(abs(out2 - p2).max(), 0, "%s: out2 is correct" % name)
+
+                # a single output array
+                o1, o2 = det.calc_cartesian_positions(*args, out1=numpy.zeros_like(p1))
+                self.assertEqual(abs(o1 - p1).max(), 0, "%s: out1 alone is correct" % name)
+                self.assertEqual(abs(o2 - p2).max(), 0, "%s: out1 alone is correct" % name)
+
+    def test_detector_full_grid_cache(self):
+        """
+        The positions of all pixels of a distorted detector are cached: check
+        that the caller owns the returned arrays and that the grid follows the
+        detector. Regular grids are not cached.
+        """
+        eiger = detector_factory("eiger1m")
+        p1, p2 = eiger.calc_cartesian_positions()
+        self.assertEqual(eiger._cartesian_cache, {}, "no distortion: nothing is cached")
+        offset = numpy.zeros(eiger.max_shape)
+        offset[0, 0] = 50  # percent of a pixel
+        eiger.offset1 = offset
+        eiger.offset2 = numpy.zeros(eiger.max_shape)
+        q1, q2 = eiger.calc_cartesian_positions()
+        self.assertEqual(len(eiger._cartesian_cache), 1, "distorted grid is cached")
+        self.assertAlmostEqual(q1[0, 0], p1[0, 0] + eiger.pixel1 / 2.)
+        self.assertEqual(abs(q1[1:] - p1[1:]).max(), 0, "only the first pixel moved")
+        self.assertEqual(abs(q2 - p2).max(), 0)
+        ref1, ref2 = q1.copy(), q2.copy()
+
+        # modifying the result does not alter the cache
+        q1[...] = 0
+        q2 += 1
+        r1, r2 = eiger.calc_cartesian_positions()
+        self.assertEqual(abs(r1 - ref1).max(), 0, "cache is not modified by the caller")
+        self.assertEqual(abs(r2 - ref2).max(), 0, "cache is not modified by the caller")
+
+        # change of pixel size
+        eiger.pixel1 = 2 * eiger.pixel1
+        r1, r2 = eiger.calc_cartesian_positions()
+        self.assertTrue(numpy.allclose(r1, 2 * ref1), "grid follows pixel1")
+        self.assertEqual(abs(r2 - ref2).max(), 0, "pixel2 is unchanged")
+
+        # change of binning, with the shape of the detector
+        sx30 = detector_factory("rayonixsx30hs")
+        sx30.binning = 2
+        p1, p2 = sx30.calc_cartesian_positions()
+        self.assertEqual(p1.shape, (960, 960))
+        self.assertAlmostEqual(p1[0, 0], sx30.pixel1 / 2.)
+        sx30.binning = 4
+        p1, p2 = sx30.calc_cartesian_positions()
+        self.assertEqual(p1.shape, (480, 480))
+        self.assertAlmostEqual(p1[0, 0], sx30.pixel1 / 2.)
+        self.assertAlmostEqual(p2[-1, -1], 479.5 * sx30.pixel2)
+
+    def test_detector_full_grid(self):
+        """
+        Without pixel coordinates, the positions of all the pixels are given
+        """
+        eiger = detector_factory("eiger1m")
+        p1, p2 = eiger.calc_cartesian_positions()
+        self.assertEqual(p1.shape, (1065, 1030))
+        self.assertEqual(p2.shape, (1065, 1030))
+        self.assertAlmostEqual(p1[0, 0], 75e-6 / 2.)
+        self.assertAlmostEqual(p2[0, 0], 75e-6 / 2.)
+        self.assertAlmostEqual(p1[-1, -1], 1064.5 * 75e-6)
+        self.assertAlmostEqual(p2[-1, -1], 1029.5 * 75e-6)
+
+        xpad = detector_factory("xpad_flat")
+        p1, p2 = xpad.calc_cartesian_positions()
+        self.assertEqual(p1.shape, (960, 560))
+        self.assertEqual(p2.shape, (960, 560))
+        self.assertAlmostEqual(p1[0, 0], 130e-6 / 2.)
+        self.assertAlmostEqual(p2[0, 0], 130e-6 / 2.)
+        # the last pixel is shifted by the 7 gaps between modules in y, 6 in x
+        self.assertAlmostEqual(p1[-1, -1], (959.5 + 7 * (3 + 3.57 * 1000 / 130)) * 130e-6)
+        self.assertAlmostEqual(p2[-1, -1], (559.5 + 6 * 3) * 130e-6)
+
+    def test_detector_xpad_flat(self):
+        """
+        The first and last rows/columns of each module are masked and the
+        modules are separated by gaps
+        """
+        xpad = detector_factory("xpad_flat")
+        mask = xpad.mask
+        self.assertEqual(mask.shape, (960, 560))
+        rows = numpy.where(mask.all(axis=1))[0]
+        columns = numpy.where(mask.all(axis=0))[0]
+        self.assertEqual(list(rows), [i for m in range(8) for i in (120 * m, 120 * m + 119)])
+        self.assertEqual(list(columns), [i for m in range(7) for i in (80 * m, 80 * m + 79)])
+        # nothing else is masked
+        self.assertEqual(int(mask.sum()), 16 * 560 + 14 * 960 - 16 * 14)
+
+        gap1 = 3 + 3.57 * 1000 / 130
+        p1, p2 = xpad.calc_cartesian_positions()
+        for p, pixel, gap, size in ((p1[:, 0], xpad.pixel1, gap1, 120), (p2[0], xpad.pixel2, 3, 80)):
+            step = numpy.diff(p) / pixel
+            self.assertAlmostEqual(step[size - 2], 1, msg="inside a module")
+            self.assertAlmostEqual(step[size - 1], 1 + gap, msg="across a gap")
+            self.assertAlmostEqual(step[size], 1, msg="inside the next module")
+            self.assertTrue(numpy.allclose(numpy.delete(step, numpy.arange(size - 1, step.size, size)), 1),
+                            "pixels are contiguous within modules")
+
+        # same positions with pixel coordinates, integers or floats, as with the full grid
+        d1, d2 = numpy.mgrid[115:125, 75:85]
+        for dtype in (numpy.int32, numpy.int64, numpy.float32, numpy.float64):
+            q1, q2 = xpad.calc_cartesian_positions(d1.astype(dtype), d2.astype(dtype))
+            self.assertEqual(q1.dtype, numpy.float64)
+            self.assertTrue(numpy.allclose(q1, p1[115:125, 75:85], rtol=1e-12, atol=0), "d1 as %s" % dtype)
+            self.assertTrue(numpy.allclose(q2, p2[115:125, 75:85], rtol=1e-12, atol=0), "d2 as %s" % dtype)
+
     def test_detector_rayonix_sx165(self):
         """
         rayonix detectors have different pixel size depending on the binning.
@@ -126,12 +284,68 @@ class TestDetector(unittest.TestCase):
         sx165.binning = 10
         self.assertAlmostEqual(sx165.pixel1, sx165.pixel2)
 
+    def test_detector_circular_mask(self):
+        """
+        Circular detectors share the calculation of their mask, but each
+        detector owns its mask and can modify it
+        """
+        for name in ("mar345", "rayonixsx165"):
+            det1 = detector_factory(name)
+            det2 = detector_factory(name)
+            det1.binning = det2.binning = 8
+            mask = det1.mask
+            self.assertEqual(mask.dtype, numpy.int8, "%s: int8 mask" % name)
+            self.assertEqual(mask[0, 0], 1, "%s: corner is masked" % name)
+            self.assertEqual(mask[mask.shape[0] // 2, mask.shape[1] // 2], 0, "%s: center is valid" % name)
+            det1.mask[0, :] = 1
+            det1.mask[1, 1] = 0
+            self.assertEqual(det1.mask[1, 1], 0, "%s: mask is modified" % name)
+            self.assertEqual(det2.mask[1, 1], 1, "%s: other detectors are not affected" % name)
+
+    def test_detector_rayonix_maskfile(self):
+        """
+        A mask dropped by a change of binning is read again from its file,
+        even if the file itself did not change
+        """
+        if fabio is None:
+            logger.warning("FabIO is not available: skip test_detector_rayonix_maskfile")
+            return
+        if not os.path.isdir(self.tmp_dir):
+            os.mkdir(self.tmp_dir)
+        fd, maskfile = tempfile.mkstemp(".edf", "testRayonixMask", self.tmp_dir)
+        os.close(fd)
+        try:
+            sx30 = detector_factory("rayonixsx30hs")
+            mask = numpy.zeros(sx30.max_shape, dtype=numpy.int8)
+            mask[10:20, 30:40] = 1
+            fabio.edfimage.edfimage(data=mask).write(maskfile)
+
+            sx30.set_maskfile(maskfile)
+            self.assertEqual(abs(sx30.mask - mask).max(), 0)
+
+            # the mask does not fit the binned detector any more
+            sx30.binning = 2
+            self.assertEqual(sx30.mask, None)
+
+            sx30.set_maskfile(maskfile)
+            self.assertEqual(sx30.mask.shape, mask.shape)
+            self.assertEqual(abs(sx30.mask - mask).max(), 0)
+        finally:
+            os.unlink(maskfile)
+
 
 def test_suite_all_detectors():
     testSuite = unittest.TestSuite()
     testSuite.addTest(TestDetector("test_detector_instanciate"))
+    testSuite.addTest(TestDetector("test_detector_factory_names"))
     testSuite.addTest(TestDetector("test_detector_imxpad_s140"))
+    testSuite.addTest(TestDetector("test_detector_positions_dtype"))
+    testSuite.addTest(TestDetector("test_detector_full_grid_cache"))
+    testSuite.addTest(TestDetector("test_detector_full_grid"))
+    testSuite.addTest(TestDetector("test_detector_xpad_flat"))
     testSuite.addTest(TestDetector("test_detector_rayonix_sx165"))
+    testSuite.addTest(TestDetector("test_detector_circular_mask"))
+    testSuite.addTest(TestDetector("test_detector_rayonix_maskfile"))
     return testSuite
 
 if __name__ == '__main__':